@@ -0,0 +1,103 @@
+import os
+import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from novel_store import novel_store
+from chroma_utils import memory_manager
+from project_manager import project_manager
+
+
+class OperationMetrics:
+    """按操作名统计调用次数、排队等待与执行耗时"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops: Dict[str, dict] = {}
+
+    def record(self, op: str, wait: float, run: float, error: bool = False):
+        with self._lock:
+            m = self._ops.setdefault(op, {"count": 0, "errors": 0, "wait_ms": 0.0, "run_ms": 0.0, "max_run_ms": 0.0})
+            m["count"] += 1
+            if error:
+                m["errors"] += 1
+            m["wait_ms"] += wait * 1000
+            m["run_ms"] += run * 1000
+            m["max_run_ms"] = max(m["max_run_ms"], run * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for op, m in self._ops.items():
+                count = m["count"] or 1
+                result[op] = {
+                    "count": m["count"],
+                    "errors": m["errors"],
+                    "avg_wait_ms": round(m["wait_ms"] / count, 3),
+                    "avg_run_ms": round(m["run_ms"] / count, 3),
+                    "max_run_ms": round(m["max_run_ms"], 3),
+                }
+            return result
+
+
+class AsyncFacade:
+    """
+    同步存储对象的异步门面。
+    所有方法调用都被提交到有界线程池执行，避免文件 I/O、SQLite 和 ONNX 嵌入阻塞事件循环。
+    """
+
+    def __init__(self, target, name: str, executor: ThreadPoolExecutor, metrics: OperationMetrics):
+        self._target = target
+        self._name = name
+        self._executor = executor
+        self._metrics = metrics
+
+    def __getattr__(self, attr):
+        func = getattr(self._target, attr)
+        if not callable(func):
+            return func
+
+        op = f"{self._name}.{attr}"
+        metrics = self._metrics
+        executor = self._executor
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            submitted = time.perf_counter()
+            timing = {}
+
+            def run():
+                timing["start"] = time.perf_counter()
+                return func(*args, **kwargs)
+
+            error = False
+            try:
+                return await asyncio.get_running_loop().run_in_executor(executor, run)
+            except Exception:
+                error = True
+                raise
+            finally:
+                finished = time.perf_counter()
+                started = timing.get("start", finished)
+                metrics.record(op, started - submitted, finished - started, error)
+
+        return wrapper
+
+
+storage_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("STORAGE_MAX_WORKERS", "8")),
+    thread_name_prefix="storage"
+)
+storage_metrics = OperationMetrics()
+
+async_novel_store = AsyncFacade(novel_store, "novel_store", storage_executor, storage_metrics)
+async_memory_manager = AsyncFacade(memory_manager, "memory_manager", storage_executor, storage_metrics)
+async_project_manager = AsyncFacade(project_manager, "project_manager", storage_executor, storage_metrics)
+
+
+def shutdown_storage_executor():
+    """等待进行中的存储操作完成并关闭线程池"""
+    storage_executor.shutdown(wait=True)
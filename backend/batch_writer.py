@@ -0,0 +1,141 @@
+import os
+import time
+import asyncio
+from typing import AsyncGenerator, Dict, List, Optional
+
+from llm_pool import llm_registry
+from prompts import PromptManager
+from context_builder import ContextAssembler, estimate_tokens
+from async_store import async_novel_store, async_memory_manager
+from sse_framing import coalesce
+
+# 单个章节批量写作时同时进行的小节数。默认（0）取 LLM_MAX_CONCURRENCY 的端点并发上限（默认 8），
+# 常见的一章 5 个小节可以一轮全部并发完成；实际并发仍受该上限约束，设得更大没有意义
+BATCH_WRITE_CONCURRENCY = int(os.getenv("BATCH_WRITE_CONCURRENCY", "0"))
+# 开启审阅时，每个小节最多根据批评意见修改的次数
+BATCH_MAX_REVISIONS = int(os.getenv("BATCH_MAX_REVISIONS", "1"))
+
+
+async def _stream_llm(messages, emit, base_event: dict, window_ms: Optional[int] = None) -> str:
+    """流式调用 LLM，按合并窗口推送事件，返回完整文本"""
+    llm = llm_registry.get_llm(temperature=0.7)
+    usage = {}
+
+    async def tokens():
+        async with llm_registry.slot():
+            async for chunk in llm.astream(messages):
+                usage["last"] = chunk.usage_metadata or usage.get("last")
+                if chunk.content:
+                    yield chunk.content
+
+    parts = []
+    try:
+        async for content in coalesce(tokens(), window_ms):
+            parts.append(content)
+            await emit(dict(base_event, type="stream", content=content))
+    except asyncio.CancelledError:
+        # 整章写作被取消（客户端断开后无人重连）：上游请求随合并任务一起关闭
+        llm_registry.record_cancel(estimate_tokens("".join(parts)))
+        raise
+    text = "".join(parts)
+    llm_registry.record_usage(usage.get("last"), output_estimate=0 if usage.get("last") else estimate_tokens(text))
+    return text
+
+
+async def _write_section(project_name: str, chapter_id: str, index: int, section: dict, project_bible: str, review: bool, emit, window_ms: Optional[int] = None) -> dict:
+    """撰写（并可选审阅、修改）单个小节，完成后保存正文"""
+    section_id = section["id"]
+    base = {"section_id": section_id, "index": index, "title": section.get("title", "")}
+    outline = section.get("outline") or section.get("title", "")
+
+    queries = PromptManager.get_retrieval_queries("writer", project_name, section_outline=outline)
+    retrieved = await async_memory_manager.search_many(project_name, queries, n_results=3, limit=5, with_metadata=True)
+
+    draft = ""
+    critique = ""
+    revision = 0
+    while True:
+        assembler = ContextAssembler()
+        messages = PromptManager.get_writer_messages(
+            section_outline=assembler.add_text("outline", outline),
+            context=assembler.add_snippets("memory", retrieved, separator="\n"),
+            critique=assembler.add_text("critique", critique),
+            project_bible=project_bible
+        )
+        await emit(dict(base, agent="writer", type="section_start", revision=revision))
+        draft = await _stream_llm(messages, emit, dict(base, agent="writer", revision=revision), window_ms)
+
+        if not review or revision >= BATCH_MAX_REVISIONS:
+            break
+        await emit(dict(base, agent="reviewer", type="section_start", revision=revision))
+        critique = await _stream_llm(PromptManager.get_reviewer_messages(draft), emit, dict(base, agent="reviewer", revision=revision), window_ms)
+        if "APPROVE" in critique:
+            break
+        revision += 1
+
+    await async_novel_store.update_section(project_name, chapter_id, section_id, content=draft)
+    return dict(base, chars=len(draft), revisions=revision)
+
+
+async def write_chapter(project_name: str, chapter_id: str, review: bool = False, only_empty: bool = False, concurrency: Optional[int] = None, stream_window_ms: Optional[int] = None) -> AsyncGenerator[Dict, None]:
+    """
+    批量撰写整章：对 list_sections 返回的所有小节并发运行 writer（可选 reviewer），
+    正文写回 update_section。产出的事件字典按完成先后交错，通过 section_id 区分小节：
+    start → section_start / stream / section_end / section_error → end。
+    """
+    chapter = await async_novel_store.get_chapter(project_name, chapter_id)
+    if not chapter:
+        raise ValueError(f"Chapter not found: {chapter_id}")
+
+    sections: List[dict] = await async_novel_store.list_sections(project_name, chapter_id)
+    if only_empty:
+        sections = [s for s in sections if not s.get("content")]
+
+    project = await async_novel_store.get_project(project_name)
+    outline = (project or {}).get("novel_outline", "")
+    project_bible = ContextAssembler().add_text("bible", outline) if outline else ""
+
+    concurrency = max(1, concurrency or BATCH_WRITE_CONCURRENCY or llm_registry.max_concurrency)
+    limiter = asyncio.Semaphore(concurrency)
+    queue: asyncio.Queue = asyncio.Queue()
+    started = time.perf_counter()
+
+    async def run(index: int, section: dict):
+        # 每个小节最后必定推送一条 section_end 或 section_error，消费端据此计数
+        async with limiter:
+            try:
+                result = await _write_section(project_name, chapter_id, index, section, project_bible, review, queue.put, stream_window_ms)
+                await queue.put(dict(result, agent="writer", type="section_end"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await queue.put({"agent": "writer", "type": "section_error", "section_id": section["id"], "index": index, "error": str(e)})
+
+    yield {"agent": "system", "type": "start", "data": {
+        "chapter_id": chapter_id,
+        "sections": [{"id": s["id"], "title": s.get("title", "")} for s in sections],
+        "concurrency": concurrency,
+        "review": review,
+    }}
+
+    tasks = [asyncio.create_task(run(i, s)) for i, s in enumerate(sections)]
+    completed = failed = 0
+    try:
+        while completed + failed < len(tasks):
+            event = await queue.get()
+            if event["type"] == "section_end":
+                completed += 1
+            elif event["type"] == "section_error":
+                failed += 1
+            yield event
+    finally:
+        # 客户端断开时取消尚未完成的小节
+        for task in tasks:
+            task.cancel()
+
+    yield {"agent": "system", "type": "end", "data": {
+        "chapter_id": chapter_id,
+        "completed": completed,
+        "failed": failed,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }}
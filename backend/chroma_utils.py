@@ -1,27 +1,187 @@
 import chromadb
 from chromadb.config import Settings
+from chromadb.utils import embedding_functions
+import threading
 import uuid
 import os
+import json
 import hashlib
+from collections import OrderedDict
+from datetime import datetime
+from chunking import split_outline
+from embedding_cache import CachedEmbeddingFunction
+
+# 默认嵌入模型（chromadb DefaultEmbeddingFunction 使用的 ONNX MiniLM）
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+# 倒数排名融合的平滑常数
+RRF_K = 60
+
+class QueryResultCache:
+    """
+    按项目缓存检索结果，键为 (query, n_results, where)。
+    项目的知识库发生任何写入时整体失效；每个项目有一个代数计数，
+    检索开始后若发生了写入，检索结果不会被写回缓存，避免缓存旧数据。
+    """
+
+    def __init__(self, max_entries_per_project: int = 128):
+        self.max_entries_per_project = max_entries_per_project
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def make_key(self, query, n_results: int, where: dict = None):
+        return (json.dumps(query, ensure_ascii=False), n_results, json.dumps(where, sort_keys=True) if where else "")
+
+    def generation(self, project_name: str) -> int:
+        with self._lock:
+            return self._generations.get(project_name, 0)
+
+    def get(self, project_name: str, key):
+        with self._lock:
+            entries = self._entries.get(project_name)
+            if entries is not None and key in entries:
+                entries.move_to_end(key)
+                self.hits += 1
+                return entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, project_name: str, key, value, generation: int):
+        with self._lock:
+            if self._generations.get(project_name, 0) != generation:
+                return
+            entries = self._entries.setdefault(project_name, OrderedDict())
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries_per_project:
+                entries.popitem(last=False)
+
+    def invalidate(self, project_name: str):
+        with self._lock:
+            self._generations[project_name] = self._generations.get(project_name, 0) + 1
+            if self._entries.pop(project_name, None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "projects": len(self._entries),
+                "entries": sum(len(e) for e in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
 
 class MemoryManager:
     def __init__(self):
         # Ensure absolute path for persistence to avoid CWD issues
         base_dir = os.path.dirname(os.path.abspath(__file__))
-        persist_dir = os.path.join(base_dir, "chroma_db")
+        self.persist_dir = os.path.join(base_dir, "chroma_db")
         
-        self.client = chromadb.PersistentClient(path=persist_dir)
+        # 客户端与嵌入模型延迟到 open() 时创建，由应用生命周期统一管理
+        self._client = None
+        self.embedding_function = None
+        # 可重入：持锁期间访问 self.client 可能再进入 open()
+        self._lock = threading.RLock()
+        # 检索结果缓存，写入时自动失效
+        self.query_cache = QueryResultCache(int(os.getenv("QUERY_CACHE_SIZE", "128")))
+        # 项目名 -> 集合名 / 集合句柄，避免每次操作都做 MD5 和 get_or_create_collection
+        self._collection_names = {}
+        self._collections = {}
+
+    def open(self, warmup: bool = False):
+        """打开 PersistentClient 并加载嵌入模型（幂等）"""
+        with self._lock:
+            if self._client is None:
+                # 嵌入结果按内容哈希缓存（内存 LRU + 磁盘），相同文本不再重复计算
+                base_dir = os.path.dirname(self.persist_dir)
+                self.embedding_function = CachedEmbeddingFunction(
+                    embedding_functions.DefaultEmbeddingFunction(),
+                    model_name=EMBEDDING_MODEL_NAME,
+                    db_path=os.getenv("EMBEDDING_CACHE_DB", os.path.join(base_dir, "cache", "embeddings.sqlite3")),
+                    max_memory_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+                )
+                self._client = chromadb.PersistentClient(path=self.persist_dir)
+        if warmup:
+            # 直接调用底层模型触发 ONNX 加载，避免首个请求承担初始化开销
+            self.embedding_function.inner(["warmup"])
+        return self
+
+    def close(self):
+        """释放客户端（应用退出时调用）"""
+        with self._lock:
+            client, self._client = self._client, None
+            self._collections.clear()
+        if client is not None:
+            clear_cache = getattr(client, "clear_system_cache", None)
+            if clear_cache:
+                clear_cache()
+
+    def embedding_stats(self):
+        """嵌入缓存命中统计"""
+        if self.embedding_function is None:
+            return {}
+        return self.embedding_function.stats()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self.open()
+        return self._client
 
     def _get_collection_name(self, project_name: str):
-        # Generate a consistent, safe collection name using hashing
-        # This handles non-ASCII characters (like Chinese) correctly by mapping them to a hex string
-        hash_object = hashlib.md5(project_name.encode())
-        hex_dig = hash_object.hexdigest()
-        return f"novel_{hex_dig}"
+        name = self._collection_names.get(project_name)
+        if name is None:
+            # Generate a consistent, safe collection name using hashing
+            # This handles non-ASCII characters (like Chinese) correctly by mapping them to a hex string
+            hash_object = hashlib.md5(project_name.encode())
+            hex_dig = hash_object.hexdigest()
+            name = f"novel_{hex_dig}"
+            self._collection_names[project_name] = name
+        return name
 
     def _get_collection(self, project_name: str):
-        collection_name = self._get_collection_name(project_name)
-        return self.client.get_or_create_collection(name=collection_name)
+        collection = self._collections.get(project_name)
+        if collection is not None:
+            return collection
+        # 检查、创建、写入缓存与删除集合持同一把锁，避免把刚删除的集合句柄放回缓存
+        with self._lock:
+            collection = self._collections.get(project_name)
+            if collection is None:
+                collection = self.client.get_or_create_collection(
+                    name=self._get_collection_name(project_name),
+                    embedding_function=self.embedding_function
+                )
+                self._collections[project_name] = collection
+            return collection
+
+    def _forget_collection(self, project_name: str):
+        """集合被删除后丢弃缓存的句柄"""
+        with self._lock:
+            self._collections.pop(project_name, None)
+
+    def warm_up_collections(self, project_names: list):
+        """预先加载已有项目的集合句柄（不会为没有知识库的项目创建集合）"""
+        loaded = 0
+        for project_name in project_names:
+            if project_name in self._collections:
+                continue
+            with self._lock:
+                try:
+                    collection = self.client.get_collection(
+                        name=self._get_collection_name(project_name),
+                        embedding_function=self.embedding_function
+                    )
+                except Exception:
+                    continue  # Collection doesn't exist yet
+                self._collections.setdefault(project_name, collection)
+            loaded += 1
+        return loaded
 
     def add_memory(self, project_name: str, content: str, metadata: dict = None):
         """添加一段记忆（角色小传、情节要点等）"""
@@ -30,24 +190,127 @@ class MemoryManager:
             
         collection = self._get_collection(project_name)
         doc_id = str(uuid.uuid4())
-        collection.add(
-            documents=[content],
-            metadatas=[metadata],
-            ids=[doc_id]
-        )
+        try:
+            collection.add(
+                documents=[content],
+                metadatas=[metadata],
+                ids=[doc_id]
+            )
+        finally:
+            self.query_cache.invalidate(project_name)
         return doc_id
 
-    def search_memory(self, project_name: str, query: str, n_results=3):
-        """根据查询检索相关记忆"""
+    def add_memories(self, project_name: str, documents: list, metadatas: list):
+        """批量添加多段记忆，只调用一次 collection.add"""
+        if not documents:
+            return []
+        collection = self._get_collection(project_name)
+        ids = [str(uuid.uuid4()) for _ in documents]
+        try:
+            collection.add(
+                documents=documents,
+                metadatas=metadatas,
+                ids=ids
+            )
+        finally:
+            self.query_cache.invalidate(project_name)
+        return ids
+
+    def ingest_document(self, project_name: str, content: str, metadata: dict = None, max_chars: int = 600, overlap: int = 80):
+        """
+        把一份较长的策划输出按标题切分为角色/世界观/章节等片段后批量入库。
+        每个片段的 metadata 包含 project、chapter、section、type（片段类型）、
+        source（原始类型，如 plan_novel）、heading 和 chunk 序号。
+        """
+        metadata = dict(metadata or {})
+        source = metadata.pop("type", "general")
+        base = {
+            "project": project_name,
+            "chapter": metadata.pop("chapter", "") or "",
+            "section": metadata.pop("section", "") or "",
+            "source": source,
+            "created_at": datetime.now().isoformat(),
+        }
+        base.update(metadata)
+        group_id = str(uuid.uuid4())
+
+        chunks = split_outline(content, max_chars=max_chars, overlap=overlap, default_type=source)
+        documents = [c["content"] for c in chunks]
+        metadatas = [
+            dict(base, type=c["type"], heading=c["heading"], chunk=i, group=group_id)
+            for i, c in enumerate(chunks)
+        ]
+        return self.add_memories(project_name, documents, metadatas)
+
+    def search_memory(self, project_name: str, query: str, n_results=3, where: dict = None):
+        """根据查询检索相关记忆（结果按项目缓存，知识库写入后失效）"""
+        key = self.query_cache.make_key(query, n_results, where)
+        cached = self.query_cache.get(project_name, key)
+        if cached is not None:
+            return list(cached)
+
+        generation = self.query_cache.generation(project_name)
         collection = self._get_collection(project_name)
         results = collection.query(
             query_texts=[query],
-            n_results=n_results
+            n_results=n_results,
+            where=where or None
         )
         # Flatten the list of lists
-        if results["documents"]:
-            return results["documents"][0]
-        return []
+        documents = results["documents"][0] if results["documents"] else []
+        self.query_cache.put(project_name, key, list(documents), generation)
+        return documents
+
+    def search_many(self, project_name: str, queries: list, n_results: int = 3, where: dict = None, limit: int = None, with_metadata: bool = False):
+        """
+        一次检索多个查询：所有查询在同一次 collection.query 中批量嵌入和检索，
+        结果按 id 去重后用倒数排名融合（RRF）排序。
+        默认返回文档列表；with_metadata=True 时返回 {"id", "content", "metadata", "score"}。
+        """
+        queries = [q for q in queries if q]
+        if not queries:
+            return []
+
+        key = self.query_cache.make_key(["many", queries, limit, with_metadata], n_results, where)
+        cached = self.query_cache.get(project_name, key)
+        if cached is not None:
+            return list(cached)
+
+        generation = self.query_cache.generation(project_name)
+        collection = self._get_collection(project_name)
+        results = collection.query(
+            query_texts=queries,
+            n_results=n_results,
+            where=where or None,
+            include=["documents", "metadatas"]
+        )
+        merged = self._fuse_results(results)
+        if limit is not None:
+            merged = merged[:limit]
+        if not with_metadata:
+            merged = [item["content"] for item in merged]
+        self.query_cache.put(project_name, key, list(merged), generation)
+        return merged
+
+    @staticmethod
+    def _fuse_results(results: dict, k: int = RRF_K):
+        """倒数排名融合：score = Σ 1 / (k + rank)，同一文档出现在多个查询中会累加"""
+        fused = {}
+        ids = results.get("ids") or []
+        documents = results.get("documents") or []
+        metadatas = results.get("metadatas") or []
+        for q, id_list in enumerate(ids):
+            for rank, doc_id in enumerate(id_list, start=1):
+                item = fused.get(doc_id)
+                if item is None:
+                    item = fused[doc_id] = {
+                        "id": doc_id,
+                        "content": documents[q][rank - 1] if q < len(documents) else "",
+                        "metadata": (metadatas[q][rank - 1] if q < len(metadatas) and metadatas[q] else None) or {},
+                        "score": 0.0,
+                    }
+                item["score"] += 1.0 / (k + rank)
+        return sorted(fused.values(), key=lambda item: item["score"], reverse=True)
 
     def get_all_memories(self, project_name: str):
         """获取项目的所有记忆"""
@@ -56,24 +319,58 @@ class MemoryManager:
         results = collection.get()
         return results
 
+    def list_memories(self, project_name: str, limit: int = 50, offset: int = 0, where: dict = None, include_documents: bool = True):
+        """
+        分页获取记忆，limit/offset/where 直接交给 collection.get 处理。
+        返回 (条目列表, 下一页 offset 或 None)。
+        """
+        collection = self._get_collection(project_name)
+        include = ["metadatas", "documents"] if include_documents else ["metadatas"]
+        # 多取一条用于判断是否还有下一页
+        results = collection.get(limit=limit + 1, offset=offset, where=where or None, include=include)
+        ids = results.get("ids") or []
+        documents = results.get("documents") or []
+        metadatas = results.get("metadatas") or []
+
+        items = []
+        for i, doc_id in enumerate(ids[:limit]):
+            item = {
+                'id': doc_id,
+                'metadata': metadatas[i] if i < len(metadatas) else {}
+            }
+            if include_documents:
+                item['content'] = documents[i] if i < len(documents) else ''
+            items.append(item)
+
+        next_offset = offset + limit if len(ids) > limit else None
+        return items, next_offset
+
     def clear_memory(self, project_name: str):
         """清除所有记忆（适用于新故事）"""
         # Note: delete_collection removes it entirely.
-        try:
-            collection_name = self._get_collection_name(project_name)
-            self.client.delete_collection(collection_name)
-        except ValueError:
-            pass # Collection doesn't exist
+        with self._lock:
+            try:
+                collection_name = self._get_collection_name(project_name)
+                self.client.delete_collection(collection_name)
+            except ValueError:
+                pass # Collection doesn't exist
+            finally:
+                self._forget_collection(project_name)
+                self.query_cache.invalidate(project_name)
     
     def delete_collection(self, project_name: str):
         """Delete the entire collection for this project"""
-        try:
-            collection_name = self._get_collection_name(project_name)
-            self.client.delete_collection(collection_name)
-            return True
-        except Exception as e:
-            print(f"Error deleting collection: {e}")
-            return False
+        with self._lock:
+            try:
+                collection_name = self._get_collection_name(project_name)
+                self.client.delete_collection(collection_name)
+                return True
+            except Exception as e:
+                print(f"Error deleting collection: {e}")
+                return False
+            finally:
+                self._forget_collection(project_name)
+                self.query_cache.invalidate(project_name)
     
     def delete_memory(self, project_name: str, doc_id: str):
         """删除特定的记忆条目"""
@@ -84,7 +381,9 @@ class MemoryManager:
         except Exception as e:
             print(f"Error deleting memory: {e}")
             return False
+        finally:
+            self.query_cache.invalidate(project_name)
 
-# Global instance
+# Global instance（进程内唯一，由 main.py 的 lifespan 打开和关闭）
 memory_manager = MemoryManager()
 
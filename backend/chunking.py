@@ -0,0 +1,103 @@
+import re
+from typing import List, Dict
+
+# Markdown 标题行：# 标题 / ## 2. 世界观设定
+_HEADING = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+# 段落分隔（空行）
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+
+# 根据标题关键词判断片段类型，按顺序匹配
+CHUNK_TYPES = [
+    ("character", ("角色", "人物", "小传", "主角", "配角", "反派", "character")),
+    ("world", ("世界观", "设定", "背景", "地点", "势力", "规则", "world", "setting")),
+    ("chapter", ("章", "节", "卷", "剧情", "情节", "结构", "梗概", "chapter", "section", "plot")),
+]
+
+
+def classify_heading(heading_path: List[str], default: str = "plan") -> str:
+    """从最内层标题向外查找关键词，决定片段类型"""
+    for heading in reversed(heading_path):
+        lowered = heading.lower()
+        for chunk_type, keywords in CHUNK_TYPES:
+            if any(k in lowered for k in keywords):
+                return chunk_type
+    return default
+
+
+def split_sections(text: str):
+    """按 Markdown 标题切分，返回 [(标题路径, 正文)]"""
+    sections = []
+    path: List[tuple] = []  # [(level, heading)]
+    body: List[str] = []
+
+    def emit():
+        content = "\n".join(body).strip()
+        if content:
+            sections.append(([h for _, h in path], content))
+
+    for line in text.splitlines():
+        match = _HEADING.match(line.strip())
+        if match:
+            emit()
+            body = []
+            level = len(match.group(1))
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, match.group(2).strip()))
+        else:
+            body.append(line)
+    emit()
+    return sections
+
+
+def _split_long(content: str, max_chars: int, overlap: int) -> List[str]:
+    """按段落把过长正文切成不超过 max_chars 的片段，相邻片段保留 overlap 个字符的重叠"""
+    if len(content) <= max_chars:
+        return [content]
+    overlap = min(overlap, max_chars // 2)
+
+    pieces = []
+    for paragraph in _PARAGRAPH_BREAK.split(content):
+        paragraph = paragraph.strip()
+        # 单个段落本身过长时按字符硬切
+        while len(paragraph) > max_chars:
+            pieces.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars - overlap:]
+        if paragraph:
+            pieces.append(paragraph)
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 2 > max_chars:
+            chunks.append(current)
+            tail = current[-overlap:] if overlap else ""
+            # 重叠部分放不下时直接从新段落开始
+            current = tail if len(tail) + len(piece) + 2 <= max_chars else ""
+        current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_outline(text: str, max_chars: int = 600, overlap: int = 80, default_type: str = "plan") -> List[Dict]:
+    """
+    把策划输出（Markdown 大纲）切分为适合嵌入的片段。
+    每个片段形如 {"content", "type", "heading"}，content 前带上标题路径以保留上下文，
+    type 为 character / world / chapter，无法判断时为 default_type。
+    """
+    chunks = []
+    for heading_path, content in split_sections(text or ""):
+        heading = " > ".join(heading_path)
+        chunk_type = classify_heading(heading_path, default_type)
+        for piece in _split_long(content, max_chars, overlap):
+            chunks.append({
+                "content": f"{heading}\n{piece}" if heading else piece,
+                "type": chunk_type,
+                "heading": heading,
+            })
+    if not chunks and text and text.strip():
+        # 只有标题、没有正文的大纲：整体作为片段，避免什么都没存入
+        for piece in _split_long(text.strip(), max_chars, overlap):
+            chunks.append({"content": piece, "type": default_type, "heading": ""})
+    return chunks
@@ -0,0 +1,203 @@
+import os
+import math
+import threading
+from datetime import datetime
+from typing import List, Dict, Optional
+
+from chunking import split_sections
+
+# 可选依赖：安装了 tiktoken 时精确计数，否则按字符估算
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+TOKENIZER_ENCODING = os.getenv("CONTEXT_TOKENIZER", "cl100k_base")
+TRUNCATION_MARK = "……（已截断）"
+
+# 各部分默认预算（token），可用环境变量覆盖
+DEFAULT_BUDGETS = {
+    "bible": int(os.getenv("CONTEXT_BUDGET_BIBLE", "2000")),
+    "outline": int(os.getenv("CONTEXT_BUDGET_OUTLINE", "3000")),
+    "memory": int(os.getenv("CONTEXT_BUDGET_MEMORY", "1500")),
+    "critique": int(os.getenv("CONTEXT_BUDGET_CRITIQUE", "800")),
+}
+# 排序时“新近程度”所占权重，其余为检索相关度
+RECENCY_WEIGHT = float(os.getenv("CONTEXT_RECENCY_WEIGHT", "0.2"))
+# 剩余预算少于该值时不再截断塞入片段
+MIN_SNIPPET_TOKENS = 48
+
+_encoder = None
+_encoder_lock = threading.Lock()
+_encoder_failed = False
+
+
+def _get_encoder():
+    global _encoder, _encoder_failed
+    if tiktoken is None or _encoder_failed:
+        return None
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None and not _encoder_failed:
+                try:
+                    _encoder = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception as e:
+                    # 离线环境下编码表可能无法下载，退回字符估算
+                    print(f"tiktoken 加载失败，使用字符估算: {e}")
+                    _encoder_failed = True
+    return _encoder
+
+
+def _char_cost(ch: str) -> float:
+    # 中日韩字符大约 1 token/字，其余（英文、数字、标点）大约 4 字符/token
+    return 1.0 if ord(ch) >= 0x2E80 else 0.25
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数"""
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    return math.ceil(sum(_char_cost(ch) for ch in text))
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """把文本截断到不超过 budget 个 token，尽量在换行或句末处断开"""
+    if budget <= 0 or not text:
+        return ""
+    if estimate_tokens(text) <= budget:
+        return text
+
+    mark_cost = estimate_tokens(TRUNCATION_MARK)
+    budget = max(budget - mark_cost, 1)
+    encoder = _get_encoder()
+    if encoder is not None:
+        head = encoder.decode(encoder.encode(text)[:budget])
+    else:
+        used = 0.0
+        end = 0
+        for end, ch in enumerate(text):
+            used += _char_cost(ch)
+            if used > budget:
+                break
+        head = text[:end]
+
+    # 断点落在最后 20% 以内时退回到换行/句号，避免半句话
+    for sep in ("\n", "。", ". "):
+        pos = head.rfind(sep)
+        if pos >= len(head) * 0.8:
+            head = head[:pos + len(sep)]
+            break
+    return head.rstrip() + TRUNCATION_MARK
+
+
+def condense_text(text: str, budget: int) -> str:
+    """
+    把长文本压缩到预算内。带 Markdown 标题的大纲按章节平均分配预算，
+    保留所有标题和每段开头，而不是只留下前几节；普通文本直接截断。
+    """
+    if estimate_tokens(text) <= budget:
+        return text
+    sections = split_sections(text)
+    if len(sections) < 2:
+        return truncate_to_tokens(text, budget)
+
+    headings = [" > ".join(path) for path, _ in sections]
+    heading_cost = sum(estimate_tokens(h) + 1 for h in headings)
+    share = (budget - heading_cost) // len(sections)
+    if share < MIN_SNIPPET_TOKENS:
+        return truncate_to_tokens(text, budget)
+
+    parts = []
+    for heading, (_, body) in zip(headings, sections):
+        body = truncate_to_tokens(body, share)
+        parts.append(f"## {heading}\n{body}" if heading else body)
+    return "\n\n".join(parts)
+
+
+def _parse_time(value) -> float:
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def rank_snippets(snippets: List[Dict], recency_weight: float = RECENCY_WEIGHT) -> List[Dict]:
+    """
+    按相关度与新近程度排序检索片段。
+    snippets 为 search_many(with_metadata=True) 的结果：{"content", "metadata", "score"}。
+    相关度按最高分归一化，新近程度按 created_at 的先后排名归一化。
+    """
+    if not snippets:
+        return []
+    top_score = max(s.get("score", 0.0) for s in snippets) or 1.0
+    by_time = sorted(range(len(snippets)), key=lambda i: _parse_time((snippets[i].get("metadata") or {}).get("created_at")))
+    recency = [0.0] * len(snippets)
+    if len(snippets) > 1:
+        for rank, i in enumerate(by_time):
+            recency[i] = rank / (len(snippets) - 1)
+
+    def combined(i):
+        relevance = snippets[i].get("score", 0.0) / top_score
+        return (1 - recency_weight) * relevance + recency_weight * recency[i]
+
+    return [snippets[i] for i in sorted(range(len(snippets)), key=combined, reverse=True)]
+
+
+class ContextAssembler:
+    """
+    按预算组装 prompt 上下文。每一部分（大纲、检索记忆、批评意见等）有独立的 token 预算，
+    超出时截断或压缩；检索片段先按相关度和新近程度排序，再依次装入直到预算用完。
+    report() 返回每部分原始/实际使用的 token 数，便于观察 prompt 大小。
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None):
+        self.budgets = dict(DEFAULT_BUDGETS)
+        if budgets:
+            self.budgets.update(budgets)
+        self._report = {}
+
+    def _record(self, name: str, raw_tokens: int, used_tokens: int, **extra):
+        self._report[name] = dict({"budget": self.budgets.get(name), "raw": raw_tokens, "used": used_tokens}, **extra)
+
+    def add_text(self, name: str, text: str, budget: int = None) -> str:
+        """压缩单段文本（大纲、批评意见）到预算内"""
+        budget = budget if budget is not None else self.budgets.get(name)
+        text = text or ""
+        raw = estimate_tokens(text)
+        fitted = condense_text(text, budget) if budget is not None else text
+        self._record(name, raw, estimate_tokens(fitted), trimmed=fitted != text)
+        return fitted
+
+    def add_snippets(self, name: str, snippets: List[Dict], budget: int = None, separator: str = "\n\n") -> str:
+        """把检索片段按排序结果装入预算，放不下的整段丢弃，最后一段可截断"""
+        budget = budget if budget is not None else self.budgets.get(name)
+        ranked = rank_snippets(snippets)
+        raw = sum(estimate_tokens(s.get("content", "")) for s in ranked)
+        selected = []
+        remaining = budget if budget is not None else float("inf")
+        for snippet in ranked:
+            content = snippet.get("content", "")
+            cost = estimate_tokens(content)
+            if cost <= remaining:
+                selected.append(content)
+                remaining -= cost
+            elif remaining >= MIN_SNIPPET_TOKENS:
+                selected.append(truncate_to_tokens(content, int(remaining)))
+                break
+            else:
+                break
+        fitted = separator.join(selected)
+        self._record(name, raw, estimate_tokens(fitted), candidates=len(ranked), selected=len(selected))
+        return fitted
+
+    def report(self) -> Dict:
+        sections = dict(self._report)
+        return {
+            "sections": sections,
+            "used": sum(s["used"] for s in sections.values()),
+            "raw": sum(s["raw"] for s in sections.values()),
+            "tokenizer": TOKENIZER_ENCODING if _get_encoder() is not None else "estimate",
+        }
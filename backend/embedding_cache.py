@@ -0,0 +1,151 @@
+import os
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+import chromadb
+
+
+def _numpy_by_default() -> bool:
+    # chromadb 0.5 起嵌入函数返回 numpy 数组，更早的版本返回 list
+    try:
+        major, minor = (int(x) for x in chromadb.__version__.split(".")[:2])
+        return (major, minor) >= (0, 5)
+    except ValueError:
+        return True
+
+
+class CachedEmbeddingFunction:
+    """
+    带缓存的嵌入函数包装器。
+    以 sha256(模型名 + 文本) 为键，先查内存 LRU，再查磁盘 SQLite，
+    只有都未命中的文本才交给底层模型批量计算，结果同时写回两级缓存。
+    其余属性（name、get_config 等）委托给底层嵌入函数，Chroma 看到的仍是同一个模型。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS embeddings (
+        key TEXT PRIMARY KEY,
+        dim INTEGER NOT NULL,
+        vector BLOB NOT NULL
+    )
+    """
+
+    def __init__(self, inner, model_name: str, db_path: str = None, max_memory_entries: int = 2048):
+        self.inner = inner
+        self.model_name = model_name
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._numpy_output = _numpy_by_default()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            with self._conn() as conn:
+                conn.execute(self.SCHEMA)
+
+    def __getattr__(self, attr):
+        # 只有本类没有的属性才会走到这里
+        return getattr(self.inner, attr)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        # 调用方需持有 self._lock
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _output(self, vector: np.ndarray):
+        return vector if self._numpy_output else vector.tolist()
+
+    def __call__(self, input: List[str]):
+        keys = [self._key(text) for text in input]
+        vectors = [None] * len(input)
+
+        # 1. 内存 LRU
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    vectors[i] = vector
+                    self.memory_hits += 1
+
+        # 2. 磁盘缓存（一次查询取回全部候选）
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing and self.db_path:
+            wanted = list({keys[i] for i in missing})
+            placeholders = ",".join("?" * len(wanted))
+            rows = self._conn().execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", wanted
+            ).fetchall()
+            found = {key: np.frombuffer(blob, dtype=np.float32) for key, blob in rows}
+            with self._lock:
+                for i in missing:
+                    vector = found.get(keys[i])
+                    if vector is not None:
+                        vectors[i] = vector
+                        self.disk_hits += 1
+                        self._remember(keys[i], vector)
+            missing = [i for i in missing if vectors[i] is None]
+
+        # 3. 剩余文本去重后批量交给模型计算
+        if missing:
+            pending = OrderedDict()
+            for i in missing:
+                pending.setdefault(keys[i], []).append(i)
+            computed = self.inner([input[indices[0]] for indices in pending.values()])
+            if len(computed):
+                self._numpy_output = isinstance(computed[0], np.ndarray)
+            new_rows = []
+            with self._lock:
+                for (key, indices), vector in zip(pending.items(), computed):
+                    vector = np.asarray(vector, dtype=np.float32)
+                    for i in indices:
+                        vectors[i] = vector
+                    self.misses += len(indices)
+                    self._remember(key, vector)
+                    new_rows.append((key, len(vector), vector.tobytes()))
+            if self.db_path:
+                conn = self._conn()
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO embeddings (key, dim, vector) VALUES (?, ?, ?)", new_rows)
+
+        return [self._output(v) for v in vectors]
+
+    def embed_query(self, input: List[str]):
+        # 新版 Chroma 查询时优先调用 embed_query，这里同样走缓存
+        return self(input)
+
+    def stats(self):
+        with self._lock:
+            total = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "model": self.model_name,
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / total, 4) if total else 0.0,
+            }
@@ -1,22 +1,25 @@
-import os
+import logging
 from typing import TypedDict, Annotated, List, Dict
 from langgraph.graph import StateGraph, END
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 from dotenv import load_dotenv
-from chroma_utils import memory_manager
+from llm_pool import llm_registry
+from async_store import async_novel_store, async_memory_manager
 
 # Load environment variables
 load_dotenv()
 
 from prompts import PromptManager
-from novel_store import novel_store
+from context_builder import ContextAssembler
+
+logger = logging.getLogger(__name__)
 
 # --- 1. 定义状态 ---
 class AgentState(TypedDict):
     topic: str
     project_name: str       # 新增：项目名称，用于隔离记忆
     granularity: str        # 新增：规划粒度 ("novel", "chapter", "section", "full")
+    chapter_title: str      # 章节标题（章节模式时使用）
     # 进度控制
     current_chapter: int    # 当前章节号
     current_section: int    # 当前小节号
@@ -36,18 +39,22 @@ class AgentState(TypedDict):
     final_content: str
 
 # --- 2. 初始化 LLM ---
-# 通过环境变量支持自定义 API 端点和模型
-llm = ChatOpenAI(
-    model=os.getenv("OPENAI_MODEL_NAME", "gpt-3.5-turbo"),
-    temperature=0.7,
-    base_url=os.getenv("OPENAI_BASE_URL"), # 可选：用于自定义端点，如 Ollama 或 vLLM
-    api_key=os.getenv("OPENAI_API_KEY"),
-    streaming=True
-)
+# 通过环境变量支持自定义 API 端点和模型（OPENAI_BASE_URL 可指向 Ollama 或 vLLM）
+# 与 main.py 共享同一个进程级客户端与连接池。节点均为异步实现：
+# 在 astream_events 下 ainvoke 会逐 token 触发 on_chat_model_stream 事件
+llm = llm_registry.get_llm(temperature=0.7)
 
 # --- 3. 定义 Agent 节点 ---
 
-def planner_node(state: AgentState):
+async def _project_bible(state: AgentState, assembler: ContextAssembler) -> str:
+    """项目设定集：优先使用 state 中的总大纲，否则读取项目已保存的大纲"""
+    outline = state.get("novel_outline", "")
+    if not outline:
+        project = await async_novel_store.get_project(state["project_name"])
+        outline = (project or {}).get("novel_outline", "")
+    return assembler.add_text("bible", outline) if outline else ""
+
+async def planner_node(state: AgentState, config: RunnableConfig):
     """
     策划 Agent (架构师)：负责分层生成故事结构。
     1. 文章总大纲
@@ -60,78 +67,86 @@ def planner_node(state: AgentState):
     section_num = state.get("current_section", 1)
     granularity = state.get("granularity", "full")
     
-    print(f"--- 架构师: 正在为 '{topic}' (项目: {project_name}) 构思 [粒度: {granularity}] ---")
+    logger.debug(f"架构师: 正在为 '{topic}' (项目: {project_name}) 构思 [粒度: {granularity}]")
     
-    # 准备上下文
+    # 准备上下文（按 token 预算压缩）
     context = ""
     chapter_title = state.get("chapter_title", "")  # 获取章节标题
+    assembler = ContextAssembler()
+    project_bible = await _project_bible(state, assembler) if granularity in ("chapter", "section") else ""
     
     if granularity == "chapter":
-        # 优先从 state 获取，如果没有则从记忆库检索项目大纲
-        context = state.get("novel_outline", "")
-        if not context:
+        # 总大纲已作为项目设定集放入 system 消息；没有总大纲时从记忆库检索
+        if not project_bible:
             # 从 ChromaDB 检索项目总大纲（使用项目名称而非topic）
-            retrieved = memory_manager.search_memory(project_name, f"{project_name} 总大纲 世界观 角色", n_results=3)
-            context = "\n\n".join(retrieved) if retrieved else ""
+            queries = PromptManager.get_retrieval_queries("planner", project_name, topic, granularity, chapter_title)
+            retrieved = await async_memory_manager.search_many(project_name, queries, n_results=3, limit=6, with_metadata=True)
+            context = assembler.add_snippets("memory", retrieved)
     elif granularity == "section":
-        context = state.get("chapter_structure", "")
+        context = assembler.add_text("outline", state.get("chapter_structure", ""))
         if not context:
             # 从 ChromaDB 检索章节大纲
-            retrieved = memory_manager.search_memory(project_name, f"{topic} 章节大纲", n_results=2)
-            context = "\n\n".join(retrieved) if retrieved else ""
+            queries = PromptManager.get_retrieval_queries("planner", project_name, topic, granularity, chapter_title)
+            retrieved = await async_memory_manager.search_many(project_name, queries, n_results=2, limit=4, with_metadata=True)
+            context = assembler.add_snippets("memory", retrieved)
+    if assembler.report()["sections"]:
+        logger.debug(f"架构师上下文: {assembler.report()['used']} tokens")
     
-    # 1. 生成 Prompt
-    prompt = PromptManager.get_planner_prompt(
+    # 1. 生成消息（固定前缀 + 可变后缀）
+    messages = PromptManager.get_planner_messages(
         topic=topic,
         granularity=granularity,
         current_chapter=chapter_num,
         current_section=section_num,
         context=context,
-        chapter_title=chapter_title
+        chapter_title=chapter_title,
+        project_bible=project_bible
     )
     
-    response = llm.invoke([HumanMessage(content=prompt)])
+    async with llm_registry.slot():
+        response = await llm.ainvoke(messages, config)
+    llm_registry.record_usage(response.usage_metadata)
     content = response.content
     
     # 2. 存入长期记忆 (RAG)
     try:
-        memory_manager.add_memory(project_name, content, metadata={"type": f"plan_{granularity}", "chapter": chapter_num})
+        await async_memory_manager.ingest_document(project_name, content, metadata={"type": f"plan_{granularity}", "chapter": chapter_num, "section": section_num})
     except Exception as e:
-        print(f"--- 记忆存储失败: {e} ---")
+        logger.warning(f"记忆存储失败: {e}")
     
     # 3. 自动保存到文件系统 (NovelStore)
     try:
         if granularity in ["novel", "full"]:
-            novel_store.update_project_outline(project_name, content)
-            print(f"--- 已自动保存项目大纲 ---")
+            await async_novel_store.update_project_outline(project_name, content)
+            logger.info("已自动保存项目大纲")
             
         elif granularity == "chapter":
             # 尝试查找对应的章节并保存大纲
-            chapters = novel_store.list_chapters(project_name)
+            chapters = await async_novel_store.get_chapter_index(project_name)
             # 假设 current_chapter 是基于 1 的索引，且 chapters 按 order 排序
             # 找到 order 匹配的章节
             target_chapter = next((c for c in chapters if c.get("order") == chapter_num), None)
             
             if target_chapter:
-                novel_store.update_chapter(project_name, target_chapter["id"], outline=content)
-                print(f"--- 已自动保存第 {chapter_num} 章大纲 ---")
+                await async_novel_store.update_chapter(project_name, target_chapter["id"], outline=content)
+                logger.info(f"已自动保存第 {chapter_num} 章大纲")
             else:
-                print(f"--- 未找到第 {chapter_num} 章，跳过自动保存 ---")
+                logger.info(f"未找到第 {chapter_num} 章，跳过自动保存")
 
         elif granularity == "section":
             # 尝试查找对应的章节和小节
-            chapters = novel_store.list_chapters(project_name)
+            chapters = await async_novel_store.get_chapter_index(project_name)
             target_chapter = next((c for c in chapters if c.get("order") == chapter_num), None)
             
             if target_chapter:
-                sections = novel_store.list_sections(project_name, target_chapter["id"])
+                sections = await async_novel_store.get_section_index(project_name, target_chapter["id"])
                 target_section = next((s for s in sections if s.get("order") == section_num), None)
                 
                 if target_section:
-                    novel_store.update_section(project_name, target_chapter["id"], target_section["id"], outline=content)
-                    print(f"--- 已自动保存第 {chapter_num} 章 第 {section_num} 节大纲 ---")
+                    await async_novel_store.update_section(project_name, target_chapter["id"], target_section["id"], outline=content)
+                    logger.info(f"已自动保存第 {chapter_num} 章 第 {section_num} 节大纲")
     except Exception as e:
-        print(f"--- 自动保存失败: {e} ---")
+        logger.warning(f"自动保存失败: {e}")
 
     # 根据粒度更新不同的状态字段
     updates = {"revision_number": 0}
@@ -151,7 +166,7 @@ def planner_node(state: AgentState):
 
     return updates
 
-def writer_node(state: AgentState):
+async def writer_node(state: AgentState, config: RunnableConfig):
     """
     作家 Agent：根据分层大纲撰写当前小节。
     """
@@ -168,31 +183,41 @@ def writer_node(state: AgentState):
     chapter_num = state.get("current_chapter", 1)
     section_num = state.get("current_section", 1)
     
-    print(f"--- 作家: 正在撰写第 {chapter_num} 章 第 {section_num} 节 (第 {revision_number} 版) ---")
+    logger.debug(f"作家: 正在撰写第 {chapter_num} 章 第 {section_num} 节 (第 {revision_number} 版)")
     
     # 从记忆中检索相关上下文
-    context = memory_manager.search_memory(project_name, "character setting style")
-    context_str = "\n".join(context) if context else "No context found."
+    queries = PromptManager.get_retrieval_queries("writer", project_name, state.get("topic", ""), section_outline=guide_content)
+    context = await async_memory_manager.search_many(project_name, queries, n_results=3, limit=5, with_metadata=True)
+    assembler = ContextAssembler()
+    context_str = assembler.add_snippets("memory", context, separator="\n") or "No context found."
 
-    prompt = PromptManager.get_writer_prompt(
-        section_outline=guide_content,
+    # full 模式下 guide_content 就是总大纲，不再重复放入设定集
+    project_bible = await _project_bible(state, assembler) if state.get("granularity") == "section" else ""
+    messages = PromptManager.get_writer_messages(
+        section_outline=assembler.add_text("outline", guide_content),
         context=context_str,
-        critique=critique
+        critique=assembler.add_text("critique", critique),
+        project_bible=project_bible
     )
+    logger.debug(f"作家上下文: {assembler.report()['used']} tokens")
     
-    response = llm.invoke([HumanMessage(content=prompt)])
+    async with llm_registry.slot():
+        response = await llm.ainvoke(messages, config)
+    llm_registry.record_usage(response.usage_metadata)
     return {"draft": response.content, "revision_number": revision_number + 1}
 
-def reviewer_node(state: AgentState):
+async def reviewer_node(state: AgentState, config: RunnableConfig):
     """
     评论家 Agent：评论草稿。
     """
     draft = state["draft"]
-    print("--- 评论家: 正在分析草稿 ---")
+    logger.debug("评论家: 正在分析草稿")
     
-    prompt = PromptManager.get_reviewer_prompt(draft)
+    messages = PromptManager.get_reviewer_messages(draft)
     
-    response = llm.invoke([HumanMessage(content=prompt)])
+    async with llm_registry.slot():
+        response = await llm.ainvoke(messages, config)
+    llm_registry.record_usage(response.usage_metadata)
     return {"critique": response.content}
 
 
@@ -228,27 +253,48 @@ def should_continue(state: AgentState):
 
 # --- 5. 构建图 ---
 
-workflow = StateGraph(AgentState)
+NODE_NAMES = ("planner", "writer", "reviewer")
+
+def build_graph(auto_review: bool = False):
+    """
+    构建工作流。
+    auto_review=False 为手动模式：每个agent完成后直接结束，由前端控制下一步；
+    auto_review=True 为完整流水线：writer → reviewer，未通过时回到 writer 修改。
+    """
+    workflow = StateGraph(AgentState)
 
-workflow.add_node("planner", planner_node)
-workflow.add_node("writer", writer_node)
-workflow.add_node("reviewer", reviewer_node)
+    workflow.add_node("planner", planner_node)
+    workflow.add_node("writer", writer_node)
+    workflow.add_node("reviewer", reviewer_node)
 
-workflow.set_entry_point("planner")
+    workflow.set_entry_point("planner")
+
+    # Planner 之后根据 granularity 决定是否进入 Writer
+    workflow.add_conditional_edges(
+        "planner",
+        should_write,
+        {
+            "write": "writer",
+            "end": END
+        }
+    )
 
-# Planner 之后根据 granularity 决定是否进入 Writer
-workflow.add_conditional_edges(
-    "planner",
-    should_write,
-    {
-        "write": "writer",
-        "end": END
-    }
-)
+    if auto_review:
+        workflow.add_edge("writer", "reviewer")
+        workflow.add_conditional_edges(
+            "reviewer",
+            should_continue,
+            {
+                "revise": "writer",
+                "end": END
+            }
+        )
+    else:
+        workflow.add_edge("writer", END)
+        workflow.add_edge("reviewer", END)
 
-# 手动模式：每个agent完成后直接结束，由前端控制下一步
-workflow.add_edge("writer", END)
-workflow.add_edge("reviewer", END)
+    return workflow.compile()
 
-app = workflow.compile()
+app = build_graph()
+pipeline_app = build_graph(auto_review=True)
 
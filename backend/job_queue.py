@@ -0,0 +1,343 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from typing import AsyncGenerator, Callable, Dict, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+
+class _LiveJob:
+    """运行中任务的内存状态：已产生的事件与等待新事件的订阅者"""
+
+    def __init__(self, first_seq: int):
+        self.first_seq = first_seq
+        self.events: List[str] = []
+        self.finished = False
+        self.changed = asyncio.Condition()
+
+    @property
+    def next_seq(self) -> int:
+        return self.first_seq + len(self.events)
+
+    async def append(self, payload: str) -> int:
+        async with self.changed:
+            self.events.append(payload)
+            self.changed.notify_all()
+        return self.next_seq - 1
+
+    async def finish(self):
+        async with self.changed:
+            self.finished = True
+            self.changed.notify_all()
+
+
+class JobQueue:
+    """
+    本地持久化任务队列（SQLite，无需外部消息中间件）。
+    任务由注册的处理函数执行：处理函数接收参数字典，逐条产出 SSE 帧（event_generator 风格），
+    每条帧的 data 部分作为一个事件按序号保存。客户端断开不会中断任务，
+    之后可以从任意序号重新订阅事件流。事件按批写入数据库（JOB_FLUSH_EVENTS 条或 JOB_FLUSH_INTERVAL 秒），
+    进程重启后，未完成的任务会重新排队并从头重新执行（不是从中断处继续）：
+    事件流中先插入一条 restart 事件，之后追加重新执行产生的事件；
+    处理函数的参数中会带 restarted=True，可据此跳过已经完成的工作。
+    """
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            result TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS job_events (
+            job_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (job_id, seq)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)",
+    ]
+
+    def __init__(self, db_path: str, workers: int = 2, flush_events: int = 50, flush_interval: float = 0.5):
+        self.db_path = db_path
+        self.workers = workers
+        self.flush_events = flush_events
+        self.flush_interval = flush_interval
+        self._handlers: Dict[str, Callable[[dict], AsyncGenerator[str, None]]] = {}
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancelled = set()
+        self._restarted = set()
+        self._live: Dict[str, _LiveJob] = {}
+
+    # --- 数据库 ---
+    def _db(self) -> sqlite3.Connection:
+        # 调用方需持有 self._db_lock
+        if self._conn is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                for statement in self.SCHEMA:
+                    conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, args: tuple = (), many: bool = False):
+        with self._db_lock:
+            conn = self._db()
+            with conn:
+                if many:
+                    conn.executemany(sql, args)
+                else:
+                    conn.execute(sql, args)
+
+    def _query(self, sql: str, args: tuple = ()):
+        with self._db_lock:
+            return self._db().execute(sql, args).fetchall()
+
+    def _row_to_job(self, row) -> dict:
+        job_id, kind, params, status, error, result, created_at, updated_at, events = row
+        return {
+            "id": job_id,
+            "kind": kind,
+            "params": json.loads(params),
+            "status": status,
+            "error": error,
+            "result": json.loads(result) if result else None,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "events": events,
+        }
+
+    _JOB_COLUMNS = "id, kind, params, status, error, result, created_at, updated_at, (SELECT COUNT(*) FROM job_events e WHERE e.job_id = jobs.id)"
+
+    def _set_status(self, job_id: str, status: str, error: str = None, result: str = None):
+        self._execute(
+            "UPDATE jobs SET status = ?, error = COALESCE(?, error), result = COALESCE(?, result), updated_at = ? WHERE id = ?",
+            (status, error, result, time.time(), job_id)
+        )
+
+    def _save_events(self, job_id: str, events: List[Tuple[int, str]]):
+        self._execute("INSERT OR REPLACE INTO job_events (job_id, seq, data) VALUES (?, ?, ?)", [(job_id, seq, data) for seq, data in events], many=True)
+
+    def _event_count(self, job_id: str) -> int:
+        return self._query("SELECT COUNT(*) FROM job_events WHERE job_id = ?", (job_id,))[0][0]
+
+    # --- 注册与生命周期 ---
+    def register(self, kind: str, handler: Callable[[dict], AsyncGenerator[str, None]]):
+        """
+        注册任务类型，handler(params) 返回产出 SSE 帧的异步生成器。
+        重启后重新执行的任务，params 中带 restarted=True。
+        """
+        self._handlers[kind] = handler
+
+    async def start(self):
+        """启动 worker，并把上次未完成的任务重新排队（运行到一半的任务会从头重新执行）"""
+        self._pending = asyncio.Queue()
+        rows = await asyncio.to_thread(self._query, "SELECT id, status FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING))
+        for job_id, status in rows:
+            if status == RUNNING:
+                count = await asyncio.to_thread(self._event_count, job_id)
+                await asyncio.to_thread(self._save_events, job_id, [(count, json.dumps({"agent": "system", "type": "restart", "reexecute": True}))])
+                await asyncio.to_thread(self._set_status, job_id, QUEUED)
+                self._restarted.add(job_id)
+            self._pending.put_nowait(job_id)
+        if rows:
+            print(f"任务队列: {len(rows)} 个未完成任务重新排队（中断的任务将从头执行）")
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """停止 worker；正在运行的任务保持 running 状态，下次启动时重新执行"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # --- 提交与查询 ---
+    async def submit(self, kind: str, params: dict) -> dict:
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO jobs (id, kind, params, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(params, ensure_ascii=False), QUEUED, now, now)
+        )
+        self._pending.put_nowait(job_id)
+        return await self.get(job_id)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        rows = await asyncio.to_thread(self._query, f"SELECT {self._JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job = self._row_to_job(rows[0])
+        live = self._live.get(job_id)
+        if live is not None:
+            job["events"] = live.next_seq
+        return job
+
+    async def list_jobs(self, status: str = None, limit: int = 50) -> List[dict]:
+        if status:
+            rows = await asyncio.to_thread(self._query, f"SELECT {self._JOB_COLUMNS} FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, limit))
+        else:
+            rows = await asyncio.to_thread(self._query, f"SELECT {self._JOB_COLUMNS} FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+        return [self._row_to_job(row) for row in rows]
+
+    async def cancel(self, job_id: str) -> bool:
+        job = await self.get(job_id)
+        if not job or job["status"] in FINISHED_STATUSES:
+            return False
+        task = self._running.get(job_id)
+        if task is not None:
+            self._cancelled.add(job_id)
+            task.cancel()
+        # 排队中的任务在 worker 取出时会跳过
+        await asyncio.to_thread(self._set_status, job_id, CANCELLED)
+        return True
+
+    async def events(self, job_id: str, offset: int = 0) -> AsyncGenerator[Tuple[int, str], None]:
+        """从 offset 开始产出 (序号, 事件)，任务运行中时持续等待新事件直到任务结束"""
+        # 先读已落盘的事件
+        rows = await asyncio.to_thread(self._query, "SELECT seq, data FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq", (job_id, offset))
+        for seq, data in rows:
+            live = self._live.get(job_id)
+            if live is not None and seq >= live.first_seq:
+                break
+            yield seq, data
+            offset = seq + 1
+
+        while True:
+            live = self._live.get(job_id)
+            if live is None:
+                job = await self.get(job_id)
+                if not job or job["status"] in FINISHED_STATUSES:
+                    # 任务已结束：补齐最后一批落盘的事件
+                    rows = await asyncio.to_thread(self._query, "SELECT seq, data FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq", (job_id, offset))
+                    for seq, data in rows:
+                        yield seq, data
+                    return
+                # 排队中：等待 worker 开始执行
+                await asyncio.sleep(0.5)
+                continue
+
+            async with live.changed:
+                await live.changed.wait_for(lambda: live.next_seq > offset or live.finished)
+            start = max(offset, live.first_seq)
+            for index in range(start - live.first_seq, len(live.events)):
+                yield live.first_seq + index, live.events[index]
+            offset = live.next_seq
+            if live.finished:
+                return
+
+    # --- 执行 ---
+    async def _worker(self):
+        while True:
+            job_id = await self._pending.get()
+            job = await self.get(job_id)
+            if not job or job["status"] != QUEUED:
+                continue
+            task = asyncio.create_task(self._run(job))
+            self._running[job_id] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                # 用户取消的任务继续处理下一个；否则是 worker 自身被取消（应用退出）
+                if job_id not in self._cancelled:
+                    raise
+            finally:
+                self._running.pop(job_id, None)
+                self._cancelled.discard(job_id)
+                self._restarted.discard(job_id)
+
+    async def _run(self, job: dict):
+        job_id = job["id"]
+        handler = self._handlers.get(job["kind"])
+        live = _LiveJob(job["events"])
+        self._live[job_id] = live
+        unsaved: List[Tuple[int, str]] = []
+        last_flush = time.monotonic()
+        result = None
+        error = None
+
+        async def flush():
+            nonlocal unsaved, last_flush
+            if unsaved:
+                batch, unsaved = unsaved, []
+                await asyncio.to_thread(self._save_events, job_id, batch)
+            last_flush = time.monotonic()
+
+        await asyncio.to_thread(self._set_status, job_id, RUNNING)
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+            params = dict(job["params"], restarted=True) if job_id in self._restarted else job["params"]
+            async for frame in handler(params):
+                payload = frame[len("data: "):].strip() if frame.startswith("data: ") else frame.strip()
+                if payload == "[DONE]":
+                    continue
+                seq = await live.append(payload)
+                unsaved.append((seq, payload))
+                if '"end"' in payload and json.loads(payload).get("type") == "end":
+                    result = payload
+                elif '"error"' in payload:
+                    # 处理函数（event_generator 风格）自行捕获异常，只产出 {"error": ...} 帧；
+                    # 不带 type 的错误帧表示整个任务失败（section_error 等局部错误不算）
+                    event = json.loads(payload)
+                    if isinstance(event, dict) and "error" in event and "type" not in event:
+                        error = str(event["error"])
+                if len(unsaved) >= self.flush_events or time.monotonic() - last_flush >= self.flush_interval:
+                    await flush()
+            await flush()
+            if error is not None:
+                await asyncio.to_thread(self._set_status, job_id, FAILED, error)
+            else:
+                await asyncio.to_thread(self._set_status, job_id, DONE, None, result)
+        except asyncio.CancelledError:
+            # 被取消（用户取消或应用退出）：保存已产生的事件，状态由取消方决定
+            await asyncio.shield(flush())
+            raise
+        except Exception as e:
+            await flush()
+            await asyncio.to_thread(self._set_status, job_id, FAILED, str(e))
+        finally:
+            self._live.pop(job_id, None)
+            await live.finish()
+
+
+# Global instance
+job_queue = JobQueue(
+    db_path=os.getenv("JOB_QUEUE_DB", os.path.join(BASE_DIR, "data", "jobs.sqlite3")),
+    workers=int(os.getenv("JOB_WORKERS", "2")),
+    flush_events=int(os.getenv("JOB_FLUSH_EVENTS", "50")),
+    flush_interval=float(os.getenv("JOB_FLUSH_INTERVAL", "0.5")),
+)
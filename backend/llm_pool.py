@@ -0,0 +1,171 @@
+import os
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+
+load_dotenv()
+
+DEFAULT_ENDPOINT = "default"
+
+
+class LLMRegistry:
+    """
+    进程级 LLM 客户端注册表。
+    按 (model, temperature, base_url, streaming) 复用 ChatOpenAI 实例，
+    同一端点共享一组保持长连接的 HTTP 客户端，并限制每个端点的并发请求数。
+    """
+
+    def __init__(self):
+        self.max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+        self.max_keepalive = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+        self.max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.timeout = float(os.getenv("LLM_TIMEOUT", "120"))
+        # 流式请求时让服务端在最后一个分块返回 usage（含缓存命中的 token 数）
+        self.report_usage = os.getenv("LLM_REPORT_USAGE", "false").lower() in ("1", "true", "yes")
+
+        self._lock = threading.Lock()
+        self._llms: Dict[Tuple, ChatOpenAI] = {}
+        self._http_clients: Dict[str, httpx.Client] = {}
+        self._async_http_clients: Dict[str, httpx.AsyncClient] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._hits = 0
+        self._misses = 0
+        self._usage = {"requests": 0, "input_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "ttft_ms_total": 0.0, "ttft_samples": 0}
+        self._cancellations = {"cancelled": 0, "tokens_before_cancel": 0, "estimated_tokens_saved": 0}
+
+    def _endpoint(self, base_url: Optional[str]) -> str:
+        return base_url or DEFAULT_ENDPOINT
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+        )
+
+    def _get_http_clients(self, endpoint: str):
+        # 调用方需持有 self._lock
+        if endpoint not in self._http_clients:
+            self._http_clients[endpoint] = httpx.Client(limits=self._limits(), timeout=self.timeout)
+            self._async_http_clients[endpoint] = httpx.AsyncClient(limits=self._limits(), timeout=self.timeout)
+        return self._http_clients[endpoint], self._async_http_clients[endpoint]
+
+    def get_llm(self, temperature: float = 0.7, model: str = None, base_url: str = None, streaming: bool = True) -> ChatOpenAI:
+        """获取（或创建）共享的 ChatOpenAI 实例"""
+        model = model or os.getenv("OPENAI_MODEL_NAME", "gpt-3.5-turbo")
+        base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        key = (model, float(temperature), self._endpoint(base_url), streaming)
+
+        with self._lock:
+            llm = self._llms.get(key)
+            if llm is not None:
+                self._hits += 1
+                return llm
+
+            self._misses += 1
+            http_client, http_async_client = self._get_http_clients(self._endpoint(base_url))
+            llm = ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                base_url=base_url,
+                api_key=os.getenv("OPENAI_API_KEY"),
+                streaming=streaming,
+                stream_usage=self.report_usage,
+                http_client=http_client,
+                http_async_client=http_async_client,
+            )
+            self._llms[key] = llm
+            return llm
+
+    @asynccontextmanager
+    async def slot(self, base_url: str = None):
+        """异步调用前占用端点并发名额"""
+        endpoint = self._endpoint(base_url or os.getenv("OPENAI_BASE_URL"))
+        with self._lock:
+            semaphore = self._semaphores.setdefault(endpoint, asyncio.Semaphore(self.max_concurrency))
+        async with semaphore:
+            self._track(endpoint, 1)
+            try:
+                yield
+            finally:
+                self._track(endpoint, -1)
+
+    def _track(self, endpoint: str, delta: int):
+        with self._lock:
+            self._in_flight[endpoint] = self._in_flight.get(endpoint, 0) + delta
+
+    def record_usage(self, usage_metadata: Optional[dict], ttft_ms: float = None, output_estimate: int = 0) -> dict:
+        """
+        记录一次调用的 token 用量，返回本次的摘要。
+        cached_tokens 取自 usage 中的 input_token_details.cache_read（服务端前缀缓存命中的输入 token）；
+        服务端未返回 usage 时，输出 token 数用调用方估算的 output_estimate 代替。
+        """
+        usage_metadata = usage_metadata or {}
+        details = usage_metadata.get("input_token_details") or {}
+        report = {
+            "input_tokens": usage_metadata.get("input_tokens", 0),
+            "output_tokens": usage_metadata.get("output_tokens", 0) or output_estimate,
+            "cached_tokens": details.get("cache_read", 0) or 0,
+        }
+        if ttft_ms is not None:
+            report["ttft_ms"] = round(ttft_ms, 1)
+        with self._lock:
+            self._usage["requests"] += 1
+            for field in ("input_tokens", "output_tokens", "cached_tokens"):
+                self._usage[field] += report[field]
+            if ttft_ms is not None:
+                self._usage["ttft_ms_total"] += ttft_ms
+                self._usage["ttft_samples"] += 1
+        return report
+
+    def record_cancel(self, output_tokens: int):
+        """
+        记录一次被中途取消的生成（客户端断开）。
+        节省的 token 按已完成调用的平均输出长度减去取消前已生成的部分估算。
+        """
+        with self._lock:
+            requests = self._usage["requests"]
+            average = self._usage["output_tokens"] / requests if requests else 0
+            self._cancellations["cancelled"] += 1
+            self._cancellations["tokens_before_cancel"] += output_tokens
+            self._cancellations["estimated_tokens_saved"] += max(0, round(average - output_tokens))
+
+    def stats(self):
+        with self._lock:
+            usage = dict(self._usage)
+            ttft_samples = usage.pop("ttft_samples")
+            ttft_total = usage.pop("ttft_ms_total")
+            usage["avg_ttft_ms"] = round(ttft_total / ttft_samples, 1) if ttft_samples else None
+            usage["cache_hit_rate"] = round(usage["cached_tokens"] / usage["input_tokens"], 4) if usage["input_tokens"] else 0.0
+            return {
+                "clients": len(self._llms),
+                "hits": self._hits,
+                "misses": self._misses,
+                "in_flight": dict(self._in_flight),
+                "max_concurrency": self.max_concurrency,
+                "report_usage": self.report_usage,
+                "usage": usage,
+                "cancellations": dict(self._cancellations),
+            }
+
+    async def aclose(self):
+        """关闭所有共享的 HTTP 客户端（应用退出时调用）"""
+        with self._lock:
+            http_clients = list(self._http_clients.values())
+            async_clients = list(self._async_http_clients.values())
+            self._llms.clear()
+            self._http_clients.clear()
+            self._async_http_clients.clear()
+        for client in async_clients:
+            await client.aclose()
+        for client in http_clients:
+            client.close()
+
+
+# Global instance
+llm_registry = LLMRegistry()
@@ -1,19 +1,57 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from graph import app as graph_app
+from graph import app as graph_app, pipeline_app, NODE_NAMES
 from typing import AsyncGenerator, List, Optional
+from contextlib import asynccontextmanager
 import json
 import asyncio
+import base64
 import os
+import re
+import time
 from dotenv import load_dotenv
 from project_manager import project_manager
 from novel_store import novel_store
 from chroma_utils import memory_manager
+from llm_pool import llm_registry
+from context_builder import ContextAssembler, estimate_tokens
+from response_cache import response_cache, replay_chunks
+from batch_writer import write_chapter
+from job_queue import job_queue
+from stream_buffer import stream_registry, parse_event_id
+from sse_framing import sse, dumps, coalesce, SSE_HEARTBEAT_SECONDS, HEARTBEAT
+from async_store import (
+    async_novel_store,
+    async_memory_manager,
+    async_project_manager,
+    storage_metrics,
+    shutdown_storage_executor,
+)
 
 load_dotenv()
 
-app = FastAPI(title="AI Novel Writer API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时打开 Chroma 客户端并预热嵌入模型，请求中只借用该单例
+    await asyncio.to_thread(memory_manager.open, True)
+    # 预加载所有已有项目的集合句柄
+    projects = await asyncio.to_thread(project_manager.list_projects)
+    await asyncio.to_thread(memory_manager.warm_up_collections, [p["name"] for p in projects if p.get("name")])
+    # 启动后台任务 worker，恢复上次未完成的任务
+    await job_queue.start()
+    yield
+    # 停止后台任务（运行中的任务保存进度，下次启动时重新执行）
+    await job_queue.stop()
+    await stream_registry.aclose()
+    # 关闭共享的 LLM HTTP 连接
+    await llm_registry.aclose()
+    shutdown_storage_executor()
+    # 写回缓冲中尚未落盘的小节修改
+    await asyncio.to_thread(novel_store.flush)
+    memory_manager.close()
+
+app = FastAPI(title="AI Novel Writer API", lifespan=lifespan)
 
 # Allow CORS for frontend
 app.add_middleware(
@@ -22,6 +60,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Stream-Id"],
 )
 
 # --- Models ---
@@ -36,6 +75,20 @@ class ChatRequest(BaseModel):
     draft: str = ""  # 草稿（reviewer使用）
     current_chapter: str = ""  # 当前章节ID
     current_section: str = ""  # 当前小节ID
+    seed: Optional[int] = None  # 指定 seed 的策划请求视为可复现，开启响应缓存时会复用相同输入的结果
+    stream_window_ms: Optional[int] = None  # token 合并窗口（毫秒），默认 SSE_COALESCE_MS，0 为逐块发送
+
+class GraphRequest(BaseModel):
+    topic: str
+    project_name: str
+    granularity: str = "section"  # novel, chapter, section, full
+    chapter_title: str = ""
+    current_chapter: int = 1  # 章节序号
+    current_section: int = 1  # 小节序号
+    novel_outline: str = ""
+    chapter_structure: str = ""
+    section_outline: str = ""
+    auto_review: bool = True  # True 时运行 writer → reviewer 的完整流水线
 
 class ProjectCreate(BaseModel):
     name: str
@@ -45,6 +98,9 @@ class ChapterCreate(BaseModel):
     title: str
     outline: str = ""
 
+class ChapterBatchCreate(BaseModel):
+    chapters: List[ChapterCreate]
+
 class ChapterUpdate(BaseModel):
     title: Optional[str] = None
     outline: Optional[str] = None
@@ -53,6 +109,9 @@ class SectionCreate(BaseModel):
     title: str
     outline: str = ""
 
+class SectionBatchCreate(BaseModel):
+    sections: List[SectionCreate]
+
 class SectionUpdate(BaseModel):
     title: Optional[str] = None
     outline: Optional[str] = None
@@ -61,16 +120,74 @@ class SectionUpdate(BaseModel):
 class OutlineUpdate(BaseModel):
     outline: str
 
+class MoveRequest(BaseModel):
+    order: int  # 目标位置（从 1 开始）
+
+class ChapterWriteRequest(BaseModel):
+    review: bool = False  # 为 True 时每个小节写完后由评论家审阅，未通过则修改
+    only_empty: bool = False  # 只撰写尚无正文的小节
+    concurrency: Optional[int] = None  # 同时撰写的小节数，默认 BATCH_WRITE_CONCURRENCY（未设置时为 LLM_MAX_CONCURRENCY）
+    stream_window_ms: Optional[int] = None  # token 合并窗口（毫秒），默认 SSE_COALESCE_MS
+
+# --- Resumable Streams ---
+def _buffered_response(stream, after_seq: int = -1):
+    """
+    把缓冲流输出为 SSE，每个事件带 "id: <stream_id>:<seq>"，断线后凭 Last-Event-ID 续传。
+    等待首个 token 等空闲期间定时发送心跳注释；客户端断开后若无人重连，后台生成会被取消。
+    """
+    from fastapi.responses import StreamingResponse
+
+    async def frames():
+        # 客户端断开时 Starlette 会取消该生成器，finally 中注销订阅
+        stream_registry.attach(stream)
+        try:
+            async for seq, payload in stream.replay(after_seq, heartbeat=SSE_HEARTBEAT_SECONDS or None):
+                if seq is None:
+                    yield HEARTBEAT
+                    continue
+                yield f"id: {stream.id}:{seq}\ndata: {payload}\n\n"
+        finally:
+            stream_registry.detach(stream)
+
+    return StreamingResponse(frames(), media_type="text/event-stream", headers={"X-Stream-Id": stream.id})
+
+def _find_resumable(last_event_id: Optional[str]):
+    """按 Last-Event-ID 查找仍在缓冲中的流，返回 (stream, seq)；没有可续传的流时返回 (None, -1)"""
+    stream_id, seq = parse_event_id(last_event_id)
+    stream = stream_registry.get(stream_id) if stream_id else None
+    if stream is None:
+        return None, -1
+    if not stream.can_resume(seq):
+        raise HTTPException(status_code=410, detail="Missed events are no longer buffered")
+    stream_registry.record_resume(stream, seq)
+    return stream, seq
+
+def _start_or_resume(last_event_id: Optional[str], make_source):
+    """带有效 Last-Event-ID 时只补发缺失的事件，否则启动新的生成"""
+    stream, seq = _find_resumable(last_event_id)
+    if stream is None:
+        stream, seq = stream_registry.start(make_source()), -1
+    return _buffered_response(stream, seq)
+
+@app.get("/api/streams/{stream_id}")
+async def resume_stream(stream_id: str, last_event_id: Optional[str] = Header(None), after: Optional[int] = None):
+    """重新连接一条流：按 Last-Event-ID 头（或 after 参数）补发之后的事件，流未结束时继续推送"""
+    seq = after if after is not None else parse_event_id(last_event_id)[1]
+    stream, seq = _find_resumable(f"{stream_id}:{seq}")
+    if stream is None:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    return _buffered_response(stream, seq)
+
 # --- Project Endpoints ---
 
 @app.get("/api/projects")
 async def list_projects():
-    return project_manager.list_projects()
+    return await async_project_manager.list_projects()
 
 @app.post("/api/projects")
 async def create_project(project: ProjectCreate):
     try:
-        return project_manager.create_project(project.name, project.description)
+        return await async_project_manager.create_project(project.name, project.description)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -78,48 +195,76 @@ async def create_project(project: ProjectCreate):
 
 @app.get("/api/projects/{project_name}/chapters")
 async def list_chapters(project_name: str):
-    return novel_store.list_chapters(project_name)
+    return await async_novel_store.list_chapters(project_name)
 
 @app.post("/api/projects/{project_name}/chapters")
 async def create_chapter(project_name: str, chapter: ChapterCreate):
-    return novel_store.create_chapter(project_name, chapter.title, chapter.outline)
+    return await async_novel_store.create_chapter(project_name, chapter.title, chapter.outline)
+
+@app.post("/api/projects/{project_name}/chapters/batch")
+async def create_chapters(project_name: str, body: ChapterBatchCreate):
+    """按顺序批量创建章节，返回创建的章节列表"""
+    items = [c.model_dump() for c in body.chapters if c.title.strip()]
+    return await async_novel_store.create_chapters(project_name, items)
 
 @app.get("/api/projects/{project_name}/chapters/{chapter_id}")
 async def get_chapter(project_name: str, chapter_id: str):
-    data = novel_store.get_chapter(project_name, chapter_id)
+    data = await async_novel_store.get_chapter(project_name, chapter_id)
     if not data:
         raise HTTPException(status_code=404, detail="Chapter not found")
     return data
 
 @app.put("/api/projects/{project_name}/chapters/{chapter_id}")
 async def update_chapter(project_name: str, chapter_id: str, body: ChapterUpdate):
-    return novel_store.update_chapter(project_name, chapter_id, body.title, body.outline)
+    return await async_novel_store.update_chapter(project_name, chapter_id, body.title, body.outline)
 
 @app.delete("/api/projects/{project_name}/chapters/{chapter_id}")
 async def delete_chapter(project_name: str, chapter_id: str):
-    success = novel_store.delete_chapter(project_name, chapter_id)
+    success = await async_novel_store.delete_chapter(project_name, chapter_id)
     if not success:
         raise HTTPException(status_code=404, detail="Chapter not found")
     return {"message": "Chapter deleted successfully"}
 
+@app.post("/api/projects/{project_name}/chapters/{chapter_id}/move")
+async def move_chapter(project_name: str, chapter_id: str, body: MoveRequest):
+    data = await async_novel_store.move_chapter(project_name, chapter_id, body.order)
+    if not data:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    return data
+
+async def chapter_write_generator(project_name: str, chapter_id: str, body: ChapterWriteRequest) -> AsyncGenerator[str, None]:
+    try:
+        async for event in write_chapter(project_name, chapter_id, body.review, body.only_empty, body.concurrency, body.stream_window_ms):
+            yield sse(event)
+    except Exception as e:
+        yield sse({'error': str(e)})
+    yield "data: [DONE]\n\n"
+
+@app.post("/api/projects/{project_name}/chapters/{chapter_id}/write")
+async def write_whole_chapter(project_name: str, chapter_id: str, body: ChapterWriteRequest, last_event_id: Optional[str] = Header(None)):
+    """并发撰写整章的所有小节，通过一个 SSE 通道推送各小节进度（事件带 section_id）"""
+    if not await async_novel_store.get_chapter(project_name, chapter_id):
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    return _start_or_resume(last_event_id, lambda: chapter_write_generator(project_name, chapter_id, body))
+
 # --- Project Detail Endpoints (must come after chapter endpoints) ---
 
 @app.get("/api/projects/{project_name}")
 async def get_project(project_name: str):
-    data = novel_store.get_project(project_name)
+    data = await async_novel_store.get_project(project_name)
     if not data:
         raise HTTPException(status_code=404, detail="Project not found")
     return data
 
 @app.put("/api/projects/{project_name}/outline")
 async def update_project_outline(project_name: str, body: OutlineUpdate):
-    return novel_store.update_project_outline(project_name, body.outline)
+    return await async_novel_store.update_project_outline(project_name, body.outline)
 
 @app.delete("/api/projects/{project_name}")
 async def delete_project(project_name: str):
-    success = novel_store.delete_project(project_name)
+    success = await async_novel_store.delete_project(project_name)
     # Also delete the knowledge base
-    memory_manager.delete_collection(project_name)
+    await async_memory_manager.delete_collection(project_name)
     if not success:
         raise HTTPException(status_code=404, detail="Project not found")
     return {"message": "Project and knowledge base deleted successfully"}
@@ -128,53 +273,155 @@ async def delete_project(project_name: str):
 
 @app.get("/api/projects/{project_name}/chapters/{chapter_id}/sections")
 async def list_sections(project_name: str, chapter_id: str):
-    return novel_store.list_sections(project_name, chapter_id)
+    return await async_novel_store.list_sections(project_name, chapter_id)
 
 @app.post("/api/projects/{project_name}/chapters/{chapter_id}/sections")
 async def create_section(project_name: str, chapter_id: str, section: SectionCreate):
-    return novel_store.create_section(project_name, chapter_id, section.title, section.outline)
+    return await async_novel_store.create_section(project_name, chapter_id, section.title, section.outline)
+
+@app.post("/api/projects/{project_name}/chapters/{chapter_id}/sections/batch")
+async def create_sections(project_name: str, chapter_id: str, body: SectionBatchCreate):
+    """按顺序批量创建小节，返回创建的小节列表"""
+    items = [sec.model_dump() for sec in body.sections if sec.title.strip()]
+    return await async_novel_store.create_sections(project_name, chapter_id, items)
 
 @app.get("/api/projects/{project_name}/chapters/{chapter_id}/sections/{section_id}")
 async def get_section(project_name: str, chapter_id: str, section_id: str):
-    data = novel_store.get_section(project_name, chapter_id, section_id)
+    data = await async_novel_store.get_section(project_name, chapter_id, section_id)
     if not data:
         raise HTTPException(status_code=404, detail="Section not found")
     return data
 
 @app.put("/api/projects/{project_name}/chapters/{chapter_id}/sections/{section_id}")
 async def update_section(project_name: str, chapter_id: str, section_id: str, body: SectionUpdate):
-    return novel_store.update_section(project_name, chapter_id, section_id, body.title, body.outline, body.content)
+    return await async_novel_store.update_section(project_name, chapter_id, section_id, body.title, body.outline, body.content)
 
 @app.delete("/api/projects/{project_name}/chapters/{chapter_id}/sections/{section_id}")
 async def delete_section(project_name: str, chapter_id: str, section_id: str):
-    success = novel_store.delete_section(project_name, chapter_id, section_id)
+    success = await async_novel_store.delete_section(project_name, chapter_id, section_id)
     if not success:
         raise HTTPException(status_code=404, detail="Section not found")
     return {"message": "Section deleted successfully"}
 
+@app.post("/api/projects/{project_name}/chapters/{chapter_id}/sections/{section_id}/move")
+async def move_section(project_name: str, chapter_id: str, section_id: str, body: MoveRequest):
+    data = await async_novel_store.move_section(project_name, chapter_id, section_id, body.order)
+    if not data:
+        raise HTTPException(status_code=404, detail="Section not found")
+    return data
+
 # --- Knowledge & Chat ---
 
+# 知识库单页最大条数
+KNOWLEDGE_PAGE_SIZE = int(os.getenv("KNOWLEDGE_PAGE_SIZE", "200"))
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """运行时指标：存储操作耗时、存储缓存命中与 LLM 客户端池状态"""
+    return {
+        "storage": storage_metrics.snapshot(),
+        "store_cache": novel_store.cache.stats(),
+        "section_writes": novel_store.write_buffer.stats(),
+        "embeddings": memory_manager.embedding_stats(),
+        "query_cache": memory_manager.query_cache.stats(),
+        "llm": llm_registry.stats(),
+        "response_cache": response_cache.stats(),
+        "streams": stream_registry.stats(),
+    }
+
+def _knowledge_where(type: Optional[str], chapter: Optional[str]):
+    """把查询参数转换为 Chroma 的 where 过滤条件"""
+    conditions = []
+    if type:
+        conditions.append({"type": type})
+    if chapter:
+        # 旧数据中 chapter 可能以整数存储
+        if chapter.isdigit():
+            conditions.append({"$or": [{"chapter": chapter}, {"chapter": int(chapter)}]})
+        else:
+            conditions.append({"chapter": chapter})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def _encode_cursor(offset: Optional[int]) -> Optional[str]:
+    if offset is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode()
+
+def _decode_cursor(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["offset"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.get("/api/projects/{project_name}/knowledge")
-async def get_project_knowledge(project_name: str):
+async def get_project_knowledge(
+    project_name: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    type: Optional[str] = None,
+    chapter: Optional[str] = None,
+    include_content: bool = True,
+    format: str = "json",
+):
+    """
+    获取项目知识库。
+    - 不传 limit：返回全部条目的列表（兼容旧版）
+    - 传 limit：返回 {"items", "next_cursor"}，用 next_cursor 获取下一页
+    - format=ndjson：逐条流式输出（内部分页读取）
+    type / chapter 过滤、include_content=false 省略正文均在 Chroma 侧完成。
+    """
+    from fastapi.responses import StreamingResponse
+
+    where = _knowledge_where(type, chapter)
+    offset = _decode_cursor(cursor)
+
+    if format == "ndjson":
+        page_size = max(1, min(limit or KNOWLEDGE_PAGE_SIZE, KNOWLEDGE_PAGE_SIZE))
+
+        async def stream():
+            # 响应头已发出，出错时只能以一行 {"error": ...} 告知客户端
+            try:
+                next_offset = offset
+                while next_offset is not None:
+                    items, next_offset = await async_memory_manager.list_memories(
+                        project_name, limit=page_size, offset=next_offset, where=where, include_documents=include_content
+                    )
+                    for item in items:
+                        yield json.dumps(item, ensure_ascii=False) + "\n"
+            except Exception as e:
+                yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
     try:
-        memories = memory_manager.get_all_memories(project_name)
-        # 格式化返回数据
+        if limit is not None:
+            items, next_offset = await async_memory_manager.list_memories(
+                project_name, limit=max(1, min(limit, KNOWLEDGE_PAGE_SIZE)), offset=offset, where=where, include_documents=include_content
+            )
+            return {"items": items, "next_cursor": _encode_cursor(next_offset)}
+
+        # 兼容旧版：分页读取后合并为一个列表
         result = []
-        if memories and 'ids' in memories:
-            for i, doc_id in enumerate(memories['ids']):
-                result.append({
-                    'id': doc_id,
-                    'content': memories['documents'][i] if i < len(memories['documents']) else '',
-                    'metadata': memories['metadatas'][i] if i < len(memories['metadatas']) else {}
-                })
+        next_offset = offset
+        while next_offset is not None:
+            items, next_offset = await async_memory_manager.list_memories(
+                project_name, limit=KNOWLEDGE_PAGE_SIZE, offset=next_offset, where=where, include_documents=include_content
+            )
+            result.extend(items)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         return {"error": str(e)}
 
 @app.delete("/api/projects/{project_name}/knowledge/{memory_id}")
 async def delete_knowledge_item(project_name: str, memory_id: str):
     """删除知识库中的特定记忆"""
-    success = memory_manager.delete_memory(project_name, memory_id)
+    success = await async_memory_manager.delete_memory(project_name, memory_id)
     if not success:
         raise HTTPException(status_code=404, detail="Memory not found")
     return {"message": "Memory deleted successfully"}
@@ -182,58 +429,140 @@ async def delete_knowledge_item(project_name: str, memory_id: str):
 @app.delete("/api/projects/{project_name}/knowledge")
 async def clear_knowledge_base(project_name: str):
     """清空项目的整个知识库"""
-    memory_manager.clear_memory(project_name)
+    await async_memory_manager.clear_memory(project_name)
     return {"message": "Knowledge base cleared successfully"}
 
 # Title Extraction
 class ExtractTitlesRequest(BaseModel):
     outline: str
     extract_type: str = "chapter"  # "chapter" or "section"
+    stream: bool = False  # 为 True 时逐行流式返回解析出的标题
+    stream_format: str = "sse"  # "sse" or "ndjson"
+    use_cache: bool = True  # 开启响应缓存时，相同大纲直接返回上次的结果；为 False 时强制重新提取
+
+# 标题清洗规则在导入时预编译
+_TITLE_NUMBER_PREFIX = re.compile(r'^\d+[\:：\.\s]+')
+_TITLE_TRANSLATIONS = {
+    "chapter": str.maketrans({'第': None, '章': None, '：': ':', '、': None}),
+    "section": str.maketrans({'第': None, '节': None, '：': ':', '、': None}),
+}
+
+def _clean_title(line: str, extract_type: str) -> str:
+    """移除 "第X章：" / "第X节：" 之类的编号前缀"""
+    line = line.strip()
+    if not line:
+        return ""
+    table = _TITLE_TRANSLATIONS["chapter" if extract_type == "chapter" else "section"]
+    # 如果以数字开头,移除数字和分隔符
+    return _TITLE_NUMBER_PREFIX.sub('', line.translate(table)).strip()
+
+async def _generate_text(llm, messages, cache_key: str = None, stats: dict = None) -> AsyncGenerator[str, None]:
+    """
+    逐块产出 LLM 输出文本。给定 cache_key 时先查响应缓存，命中则按块回放缓存内容；
+    未命中时流式调用 LLM，完整结束后写入缓存。stats 用于回传 cached / ttft_ms / usage。
+    生成中途被取消（客户端断开）时关闭上游请求，不写缓存，只记录取消统计。
+    """
+    stats = stats if stats is not None else {}
+    if cache_key:
+        cached = await asyncio.to_thread(response_cache.get, cache_key)
+        if cached is not None:
+            stats["cached"] = True
+            for piece in replay_chunks(cached):
+                yield piece
+            return
+
+    parts = []
+    usage = None
+    started = time.perf_counter()
+    try:
+        async with llm_registry.slot():
+            async for chunk in llm.astream(messages):
+                # 开启 LLM_REPORT_USAGE 时 usage 在最后一个分块返回
+                usage = chunk.usage_metadata or usage
+                content = chunk.content
+                if content:
+                    if "ttft_ms" not in stats:
+                        stats["ttft_ms"] = (time.perf_counter() - started) * 1000
+                    parts.append(content)
+                    yield content
+    except (asyncio.CancelledError, GeneratorExit):
+        llm_registry.record_cancel(estimate_tokens("".join(parts)))
+        raise
+    output_estimate = 0 if usage else estimate_tokens("".join(parts))
+    stats["usage"] = llm_registry.record_usage(usage, stats.get("ttft_ms"), output_estimate)
+    if cache_key and parts:
+        await asyncio.to_thread(response_cache.put, cache_key, "".join(parts), getattr(llm, "model_name", ""))
+
+async def _stream_titles(llm, messages, extract_type: str, stream_format: str, cache_key: str = None) -> AsyncGenerator[str, None]:
+    """边生成边按行解析标题，每解析出一个标题就推送一条事件"""
+    def frame(payload: dict) -> str:
+        if stream_format == "ndjson":
+            return dumps(payload) + "\n"
+        return sse(payload)
+
+    titles = []
+    buffer = ""
+    stats = {}
+    try:
+        async for content in _generate_text(llm, messages, cache_key, stats):
+            buffer += content
+            *lines, buffer = buffer.split('\n')
+            for line in lines:
+                title = _clean_title(line, extract_type)
+                if title:
+                    titles.append(title)
+                    yield frame({'type': 'title', 'index': len(titles) - 1, 'title': title})
+        title = _clean_title(buffer, extract_type)
+        if title:
+            titles.append(title)
+            yield frame({'type': 'title', 'index': len(titles) - 1, 'title': title})
+        yield frame({'type': 'end', 'titles': titles, 'count': len(titles), 'cached': stats.get('cached', False)})
+    except Exception as e:
+        yield frame({'error': str(e)})
+    if stream_format != "ndjson":
+        yield "data: [DONE]\n\n"
 
 @app.post("/api/extract-titles")
 async def extract_titles(request: ExtractTitlesRequest):
     """从大纲中提取标题列表"""
     from prompts import PromptManager
-    from langchain_core.messages import HumanMessage
-    from langchain_openai import ChatOpenAI
+    from fastapi.responses import StreamingResponse
     
-    # 初始化 LLM
-    llm = ChatOpenAI(
-        model=os.getenv("OPENAI_MODEL_NAME", "gpt-3.5-turbo"),
-        temperature=0.3,
-        base_url=os.getenv("OPENAI_BASE_URL"),
-        api_key=os.getenv("OPENAI_API_KEY")
-    )
+    # 获取共享 LLM 客户端
+    llm = llm_registry.get_llm(temperature=0.3, streaming=False)
     
-    prompt = PromptManager.get_extract_titles_prompt(request.outline, request.extract_type)
+    messages = PromptManager.get_extract_titles_messages(request.outline, request.extract_type)
+    # 低温度的标题提取结果可复现，开启响应缓存时按输入复用
+    cache_key = None
+    if response_cache.enabled and request.use_cache:
+        cache_key = response_cache.make_key(llm, messages, extract_type=request.extract_type)
+
+    if request.stream:
+        media_type = "application/x-ndjson" if request.stream_format == "ndjson" else "text/event-stream"
+        return StreamingResponse(
+            _stream_titles(llm, messages, request.extract_type, request.stream_format, cache_key),
+            media_type=media_type
+        )
     
     try:
-        response = llm.invoke([HumanMessage(content=prompt)])
-        content = response.content
+        content = await asyncio.to_thread(response_cache.get, cache_key) if cache_key else None
+        cached = content is not None
+        if not cached:
+            async with llm_registry.slot():
+                response = await llm.ainvoke(messages)
+            llm_registry.record_usage(response.usage_metadata)
+            content = response.content
+            if cache_key:
+                await asyncio.to_thread(response_cache.put, cache_key, content, llm.model_name)
         
         # 解析标题
-        lines = content.split('\n')
         titles = []
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            # 移除编号前缀
-            if request.extract_type == "chapter":
-                title = line.replace('第', '').replace('章', '').replace('：', ':').replace('、', '')
-                # 如果以数字开头,移除数字和分隔符
-                import re
-                title = re.sub(r'^\d+[\:：\.\s]+', '', title).strip()
-            else:  # section
-                title = line.replace('第', '').replace('节', '').replace('：', ':').replace('、', '')
-                import re
-                title = re.sub(r'^\d+[\:：\.\s]+', '', title).strip()
-            
+        for line in content.split('\n'):
+            title = _clean_title(line, request.extract_type)
             if title:
                 titles.append(title)
         
-        return {"titles": titles, "count": len(titles)}
+        return {"titles": titles, "count": len(titles), "cached": cached}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -248,89 +577,102 @@ async def event_generator(
     section_outline: str = "",
     draft: str = "",
     current_chapter: str = "",
-    current_section: str = ""
+    current_section: str = "",
+    seed: Optional[int] = None,
+    stream_window_ms: Optional[int] = None
     ) -> AsyncGenerator[str, None]:
-    from langchain_core.messages import HumanMessage
-    from langchain_openai import ChatOpenAI
     from prompts import PromptManager
-    from chroma_utils import MemoryManager
-    # 初始化 LLM
-    llm = ChatOpenAI(
-        model=os.getenv("OPENAI_MODEL_NAME", "gpt-3.5-turbo"),
-        temperature=0.7,
-        base_url=os.getenv("OPENAI_BASE_URL"),
-        api_key=os.getenv("OPENAI_API_KEY"),
-        streaming=True
-    )
-    
-    memory_manager = MemoryManager()
+    # 获取共享 LLM 客户端
+    llm = llm_registry.get_llm(temperature=0.7)
+    # 按 token 预算组装上下文
+    assembler = ContextAssembler()
     
     try:
-        yield f"data: {json.dumps({'agent': 'system', 'data': {'message': f'开始{agent}工作...'}})}\n\n"
+        yield sse({'agent': 'system', 'data': {'message': f'开始{agent}工作...'}})
         
-        # 根据agent类型生成不同的prompt
+        # 项目设定集（压缩后的总大纲）放在 system 消息中，作为同一项目各请求共享的前缀
+        project_bible = ""
+        if agent in ("planner", "writer") and granularity != "novel":
+            project = await async_novel_store.get_project(project_name)
+            if project and project.get("novel_outline"):
+                project_bible = assembler.add_text("bible", project["novel_outline"])
+
+        # 根据agent类型生成不同的消息（固定前缀 + 可变后缀）
         if agent == "planner":
             # 准备上下文
             context = ""
-            if granularity == "chapter":
-                retrieved = memory_manager.search_memory(project_name, f"{project_name} 总大纲 世界观 角色", n_results=3)
-                context = "\n\n".join(retrieved) if retrieved else ""
+            if granularity == "chapter" and not project_bible:
+                # 有总大纲时它已在设定集中，无需再检索
+                queries = PromptManager.get_retrieval_queries("planner", project_name, topic, granularity, chapter_title)
+                retrieved = await async_memory_manager.search_many(project_name, queries, n_results=3, limit=6, with_metadata=True)
+                context = assembler.add_snippets("memory", retrieved)
             elif granularity == "section":
-                retrieved = memory_manager.search_memory(project_name, f"{topic} 章节大纲", n_results=2)
-                context = "\n\n".join(retrieved) if retrieved else ""
+                queries = PromptManager.get_retrieval_queries("planner", project_name, topic, granularity, chapter_title)
+                retrieved = await async_memory_manager.search_many(project_name, queries, n_results=2, limit=4, with_metadata=True)
+                context = assembler.add_snippets("memory", retrieved)
 
             # 获取章节/小节 order（序号）
             chapter_order = 1
             section_order = 1
             if current_chapter:
-                from novel_store import novel_store
-                chapter_data = novel_store.get_chapter(project_name, current_chapter)
+                chapter_data = await async_novel_store.get_chapter(project_name, current_chapter)
                 if chapter_data and "order" in chapter_data:
                     chapter_order = chapter_data["order"]
             if current_chapter and current_section:
-                from novel_store import novel_store
-                section_data = novel_store.get_section(project_name, current_chapter, current_section)
+                section_data = await async_novel_store.get_section(project_name, current_chapter, current_section)
                 if section_data and "order" in section_data:
                     section_order = section_data["order"]
 
-            prompt = PromptManager.get_planner_prompt(
+            messages = PromptManager.get_planner_messages(
                 topic=topic,
                 granularity=granularity,
                 current_chapter=chapter_order,
                 current_section=section_order,
                 context=context,
-                chapter_title=chapter_title
+                chapter_title=chapter_title,
+                project_bible=project_bible
             )
             
         elif agent == "writer":
             # 从记忆中检索相关上下文
-            context_results = memory_manager.search_memory(project_name, "character setting style", n_results=3)
-            context_str = "\n".join(context_results) if context_results else ""
+            queries = PromptManager.get_retrieval_queries("writer", project_name, topic, section_outline=section_outline)
+            context_results = await async_memory_manager.search_many(project_name, queries, n_results=3, limit=5, with_metadata=True)
+            context_str = assembler.add_snippets("memory", context_results, separator="\n")
             
-            prompt = PromptManager.get_writer_prompt(
-                section_outline=section_outline or topic,
+            messages = PromptManager.get_writer_messages(
+                section_outline=assembler.add_text("outline", section_outline or topic),
                 context=context_str,
-                critique=critique
+                critique=assembler.add_text("critique", critique),
+                project_bible=project_bible
             )
             
         elif agent == "reviewer":
-            prompt = PromptManager.get_reviewer_prompt(draft or topic)
+            messages = PromptManager.get_reviewer_messages(draft or topic)
             
         else:
             raise ValueError(f"Unknown agent: {agent}")
+
+        context_report = assembler.report()
         
-        # 流式调用LLM
-        full_content = ""
-        async for chunk in llm.astream([HumanMessage(content=prompt)]):
-            content = chunk.content
-            if content:
-                full_content += content
-                yield f"data: {json.dumps({'agent': agent, 'type': 'stream', 'content': content})}\n\n"
+        # 显式指定 seed 的策划请求可复现：开启响应缓存时相同输入直接回放上次的结果
+        cache_key = None
+        if seed is not None:
+            if agent == "planner" and response_cache.enabled:
+                cache_key = response_cache.make_key(llm, messages, seed=seed)
+            llm = llm.bind(seed=seed)
+
+        # 流式调用LLM：窗口期内的 token 合并为一个事件，全文最后一次性拼接
+        parts = []
+        stats = {}
+        async for content in coalesce(_generate_text(llm, messages, cache_key, stats), stream_window_ms):
+            parts.append(content)
+            yield sse({'agent': agent, 'type': 'stream', 'content': content})
+        full_content = "".join(parts)
         
-        # 存储到记忆库（仅planner）
-        if agent == "planner" and full_content:
+        # 存储到记忆库（仅planner；缓存回放的内容在首次生成时已写入）
+        if agent == "planner" and full_content and not stats.get("cached"):
             try:
-                memory_manager.add_memory(project_name, full_content, metadata={"type": f"plan_{granularity}", "chapter": current_chapter or 1, "section": current_section or ""})
+                await async_memory_manager.ingest_document(project_name, full_content, metadata={"type": f"plan_{granularity}", "chapter": current_chapter or 1, "section": current_section or ""})
             except Exception as e:
                 print(f"记忆存储失败: {e}")
         
@@ -348,31 +690,148 @@ async def event_generator(
         elif agent == "reviewer":
             result_data = {"critique": full_content}
         
-        yield f"data: {json.dumps({'agent': agent, 'type': 'end', 'data': result_data})}\n\n"
+        end_event = {'agent': agent, 'type': 'end', 'data': result_data, 'context': context_report, 'cached': stats.get('cached', False)}
+        if llm_registry.report_usage and 'usage' in stats:
+            end_event['usage'] = stats['usage']
+        yield sse(end_event)
 
     except Exception as e:
-        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        yield sse({'error': str(e)})
     
     yield "data: [DONE]\n\n"
 
 @app.post("/api/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, last_event_id: Optional[str] = Header(None)):
+    # 生成在后台进行并写入缓冲流；断线后带 Last-Event-ID 重新请求只会补发缺失的事件
+    return _start_or_resume(last_event_id, lambda: event_generator(
+        agent=request.agent,
+        topic=request.topic, 
+        project_name=request.project_name, 
+        granularity=request.granularity, 
+        critique=request.critique, 
+        chapter_title=request.chapter_title,
+        section_outline=request.section_outline,
+        draft=request.draft,
+        current_chapter=request.current_chapter,
+        current_section=request.current_section,
+        seed=request.seed,
+        stream_window_ms=request.stream_window_ms
+    ))
+
+async def graph_event_generator(request: GraphRequest) -> AsyncGenerator[str, None]:
+    """运行 LangGraph 工作流，把各节点的 token 与状态更新转发为 SSE 事件"""
+    graph = pipeline_app if request.auto_review else graph_app
+    state = {
+        "topic": request.topic,
+        "project_name": request.project_name,
+        "granularity": request.granularity,
+        "chapter_title": request.chapter_title,
+        "current_chapter": request.current_chapter,
+        "current_section": request.current_section,
+        "novel_outline": request.novel_outline,
+        "chapter_structure": request.chapter_structure,
+        "section_outline": request.section_outline,
+        "critique": "",
+        "revision_number": 0,
+    }
+    try:
+        async for event in graph.astream_events(state, version="v2"):
+            kind = event["event"]
+            node = event.get("metadata", {}).get("langgraph_node")
+            if kind == "on_chat_model_stream" and node in NODE_NAMES:
+                content = event["data"]["chunk"].content
+                if content:
+                    yield sse({'agent': node, 'type': 'stream', 'content': content})
+            elif kind == "on_chain_start" and event["name"] in NODE_NAMES and event["name"] == node:
+                yield sse({'agent': node, 'type': 'start'})
+            elif kind == "on_chain_end" and event["name"] in NODE_NAMES and event["name"] == node:
+                yield sse({'agent': node, 'type': 'end', 'data': event['data'].get('output') or {}})
+    except Exception as e:
+        yield sse({'error': str(e)})
+
+    yield "data: [DONE]\n\n"
+
+@app.post("/api/graph/stream")
+async def graph_stream(request: GraphRequest):
+    """以流式方式运行完整的 planner → writer → reviewer 工作流"""
+    from fastapi.responses import StreamingResponse
+    return StreamingResponse(graph_event_generator(request), media_type="text/event-stream")
+
+# --- Background Jobs ---
+class JobCreate(BaseModel):
+    kind: str  # "chat" 或 "write_chapter"
+    params: dict  # chat: 同 ChatRequest；write_chapter: project_name、chapter_id 加 ChapterWriteRequest 字段
+
+async def _chat_job(params: dict):
+    # 重启后会重新调用 LLM（planner 也会再次写入记忆库），无法从中断处继续
+    request = ChatRequest(**params)
+    async for frame in event_generator(**request.model_dump()):
+        yield frame
+
+async def _write_chapter_job(params: dict):
+    body = ChapterWriteRequest(**params)
+    if params.get("restarted"):
+        # 每个小节完成即保存，重启后只撰写仍无正文的小节
+        body.only_empty = True
+    async for frame in chapter_write_generator(params["project_name"], params["chapter_id"], body):
+        yield frame
+
+job_queue.register("chat", _chat_job)
+job_queue.register("write_chapter", _write_chapter_job)
+
+async def job_event_generator(job_id: str, offset: int) -> AsyncGenerator[str, None]:
+    async for seq, data in job_queue.events(job_id, offset):
+        yield f"id: {seq}\ndata: {data}\n\n"
+    yield "data: [DONE]\n\n"
+
+@app.post("/api/jobs")
+async def create_job(body: JobCreate):
+    """提交后台生成任务，立即返回任务信息；进度通过 /api/jobs/{id}/stream 订阅"""
+    try:
+        if body.kind == "chat":
+            params = ChatRequest(**body.params).model_dump()
+        elif body.kind == "write_chapter":
+            if not body.params.get("project_name") or not body.params.get("chapter_id"):
+                raise ValueError("project_name and chapter_id are required")
+            params = dict(ChapterWriteRequest(**body.params).model_dump(), project_name=body.params["project_name"], chapter_id=body.params["chapter_id"])
+        else:
+            raise ValueError(f"Unknown job kind: {body.kind}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await job_queue.submit(body.kind, params)
+
+@app.get("/api/jobs")
+async def list_jobs(status: Optional[str] = None, limit: int = 50):
+    return await job_queue.list_jobs(status, limit)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}/stream")
+async def stream_job(job_id: str, offset: int = 0, last_event_id: Optional[str] = Header(None)):
+    """
+    从第 offset 个事件开始订阅任务事件流。
+    带 Last-Event-ID 头（EventSource 自动重连）时从该序号之后继续，忽略 offset 参数。
+    """
     from fastapi.responses import StreamingResponse
-    return StreamingResponse(
-        event_generator(
-            agent=request.agent,
-            topic=request.topic, 
-            project_name=request.project_name, 
-            granularity=request.granularity, 
-            critique=request.critique, 
-            chapter_title=request.chapter_title,
-            section_outline=request.section_outline,
-            draft=request.draft,
-            current_chapter=request.current_chapter,
-            current_section=request.current_section
-        ), 
-        media_type="text/event-stream"
-    )
+    if not await job_queue.get(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    if last_event_id is not None:
+        try:
+            offset = int(last_event_id) + 1
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    return StreamingResponse(job_event_generator(job_id, max(0, offset)), media_type="text/event-stream")
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    if not await job_queue.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Job not found or already finished")
+    return {"message": "Job cancelled"}
 
 if __name__ == "__main__":
     import uvicorn
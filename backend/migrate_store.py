@@ -0,0 +1,58 @@
+"""
+迁移脚本 - 将 JSON 文件存储的章节/小节导入 SQLite 后端
+用法:
+  python migrate_store.py                 # 迁移 data/projects 下的所有项目
+  python migrate_store.py 项目A 项目B      # 只迁移指定项目
+迁移完成后设置环境变量 NOVEL_STORE_BACKEND=sqlite 即可切换后端。
+数据库路径由 NOVEL_STORE_DB 指定（默认 data/novel_store.sqlite3）。
+"""
+import os
+import sys
+from dotenv import load_dotenv
+
+from storage_backends import JsonFileBackend, SQLiteBackend
+
+DATA_DIR = "data/projects"
+
+def migrate_project(source: JsonFileBackend, target: SQLiteBackend, project_name: str):
+    """导入单个项目，返回 (章节数, 小节数)"""
+    chapters = source.list_chapters(project_name)
+    sections = {c["id"]: source.list_sections(project_name, c["id"]) for c in chapters}
+    target.import_project(project_name, chapters, sections)
+    return len(chapters), sum(len(s) for s in sections.values())
+
+def main():
+    load_dotenv()
+    if not os.path.exists(DATA_DIR):
+        print(f"❌ 未找到数据目录: {DATA_DIR}")
+        sys.exit(1)
+
+    db_path = os.getenv("NOVEL_STORE_DB", os.path.join(os.path.dirname(DATA_DIR), "novel_store.sqlite3"))
+    source = JsonFileBackend(DATA_DIR)
+    target = SQLiteBackend(db_path)
+
+    projects = sys.argv[1:] or sorted(
+        name for name in os.listdir(DATA_DIR) if os.path.isdir(os.path.join(DATA_DIR, name))
+    )
+
+    print("=" * 60)
+    print(f"迁移 {len(projects)} 个项目到 {db_path}")
+    print("=" * 60)
+
+    failed = []
+    for name in projects:
+        try:
+            chapter_count, section_count = migrate_project(source, target, name)
+            print(f"✅ {name}: {chapter_count} 章, {section_count} 节")
+        except Exception as e:
+            print(f"❌ {name}: {e}")
+            failed.append(name)
+
+    if failed:
+        print(f"\n⚠️  以下项目迁移失败: {', '.join(failed)}")
+        sys.exit(1)
+
+    print("\n✅ 迁移完成！设置 NOVEL_STORE_BACKEND=sqlite 以启用 SQLite 后端")
+
+if __name__ == "__main__":
+    main()
@@ -1,210 +1,285 @@
 import os
 import json
 import shutil
+import atexit
+import threading
 import uuid
 from typing import List, Dict, Optional
 from datetime import datetime
 
+from storage_backends import StorageBackend, JsonFileCache, atomic_write_json, create_backend
+
 DATA_DIR = "data/projects"
 
+class SectionWriteBuffer:
+    """
+    小节写回缓冲（write-behind）。
+    编辑器自动保存会在短时间内连续 PUT 同一小节，这里把窗口期内的修改合并，
+    窗口结束时只落盘一次。窗口从该小节第一次未落盘的修改开始计时，
+    因此持续输入时最长延迟也不超过一个窗口。
+    """
+
+    def __init__(self, window: float, flush_callback):
+        self.window = window
+        self._flush_callback = flush_callback
+        self._lock = threading.Lock()
+        self._pending: Dict[tuple, dict] = {}
+        self._timers: Dict[tuple, threading.Timer] = {}
+        self.updates = 0
+        self.writes = 0
+
+    def stage(self, key: tuple, fields: dict):
+        """记录待写入的字段，必要时启动该小节的落盘定时器"""
+        with self._lock:
+            self.updates += 1
+            self._pending.setdefault(key, {}).update(fields)
+            self._start_timer(key)
+
+    def restore(self, key: tuple, fields: dict):
+        """落盘失败时放回已取出的字段（之后新暂存的修改优先），下个窗口重试"""
+        with self._lock:
+            self.writes -= 1
+            self._pending[key] = dict(fields, **self._pending.get(key, {}))
+            self._start_timer(key)
+
+    def _start_timer(self, key: tuple):
+        # 调用方需持有 self._lock
+        if key not in self._timers:
+            timer = threading.Timer(self.window, self._flush_callback, args=(key,))
+            timer.daemon = True
+            self._timers[key] = timer
+            timer.start()
+
+    def peek(self, key: tuple) -> Optional[dict]:
+        with self._lock:
+            fields = self._pending.get(key)
+            return dict(fields) if fields else None
+
+    def pop(self, key: tuple) -> Optional[dict]:
+        with self._lock:
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            fields = self._pending.pop(key, None)
+            if fields:
+                self.writes += 1
+            return fields
+
+    def discard(self, match):
+        """丢弃满足 match(key) 的待写入修改（对应记录已被删除）"""
+        with self._lock:
+            for key in [k for k in self._pending if match(k)]:
+                self._pending.pop(key, None)
+                timer = self._timers.pop(key, None)
+                if timer is not None:
+                    timer.cancel()
+
+    def keys(self):
+        with self._lock:
+            return list(self._pending)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "window": self.window,
+                "pending": len(self._pending),
+                "updates": self.updates,
+                "writes": self.writes,
+            }
+
 class NovelStore:
-    def __init__(self):
+    """
+    小说内容存储。项目元数据（project.json）始终保存在项目目录中，
+    章节和小节交给可插拔的 StorageBackend（JSON 文件或 SQLite）。
+    JSON 文件的读取经过进程内 LRU 缓存（NOVEL_STORE_CACHE_SIZE 条）。
+    小节更新先进入写回缓冲，SECTION_WRITE_WINDOW 秒内的多次修改合并为一次写入
+    （设为 0 则同步写入）；读取时会叠加尚未落盘的修改。
+    """
+    def __init__(self, backend: StorageBackend = None):
         if not os.path.exists(DATA_DIR):
             os.makedirs(DATA_DIR)
+        self.cache = JsonFileCache(int(os.getenv("NOVEL_STORE_CACHE_SIZE", "512")))
+        self.backend = backend or create_backend(DATA_DIR, self.cache)
+        # 保护“读-改-写”的更新操作，存储操作会在线程池中并发执行
+        self._lock = threading.RLock()
+        self.write_buffer = SectionWriteBuffer(float(os.getenv("SECTION_WRITE_WINDOW", "1.0")), self._flush_section)
+        atexit.register(self.flush)
 
     def _get_project_path(self, project_name: str):
         return os.path.join(DATA_DIR, project_name)
 
-    def _ensure_dir(self, path):
-        if not os.path.exists(path):
-            os.makedirs(path)
-
     # --- Project Level ---
     def get_project(self, project_name: str):
         path = os.path.join(self._get_project_path(project_name), "project.json")
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        return None
+        return self.cache.get(path)
 
     def update_project_outline(self, project_name: str, outline: str):
-        data = self.get_project(project_name)
-        if data:
-            data["novel_outline"] = outline
-            path = os.path.join(self._get_project_path(project_name), "project.json")
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            return data
+        # 文件写入与缓存更新须在同一把锁内，否则并发更新可能把旧大纲缓存在新文件的签名下
+        with self._lock:
+            data = self.get_project(project_name)
+            if data:
+                data["novel_outline"] = outline
+                path = os.path.join(self._get_project_path(project_name), "project.json")
+                atomic_write_json(path, data)
+                self.cache.put(path, data)
+                return data
         return None
 
     def delete_project(self, project_name: str):
         path = self._get_project_path(project_name)
-        if os.path.exists(path):
-            shutil.rmtree(path)
-            return True
+        # 与小节落盘互斥，避免定时器在删除之后把小节文件写回
+        with self._lock:
+            self.write_buffer.discard(lambda key: key[0] == project_name)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+                self.backend.delete_project(project_name)
+                self.cache.invalidate_prefix(path)
+                return True
         return False
 
     # --- Chapter Level ---
+    def get_chapter_index(self, project_name: str):
+        """返回按顺序排列的章节摘要（id、标题、顺序），不读取章节正文"""
+        return self.backend.chapter_index(project_name)
+
     def list_chapters(self, project_name: str):
-        proj_path = self._get_project_path(project_name)
-        chapters_dir = os.path.join(proj_path, "chapters")
-        if not os.path.exists(chapters_dir):
-            return []
-        
-        chapters = []
-        for chap_id in os.listdir(chapters_dir):
-            chap_path = os.path.join(chapters_dir, chap_id, "chapter.json")
-            if os.path.exists(chap_path):
-                with open(chap_path, "r", encoding="utf-8") as f:
-                    chapters.append(json.load(f))
-        
-        # Sort by order
-        chapters.sort(key=lambda x: x.get("order", 0))
-        return chapters
+        return self.backend.list_chapters(project_name)
 
-    def create_chapter(self, project_name: str, title: str, outline: str = ""):
-        proj_path = self._get_project_path(project_name)
-        chapters_dir = os.path.join(proj_path, "chapters")
-        self._ensure_dir(chapters_dir)
-        
-        # Determine order
-        existing = self.list_chapters(project_name)
-        order = len(existing) + 1
-        
-        chap_id = str(uuid.uuid4())[:8]
-        chap_dir = os.path.join(chapters_dir, chap_id)
-        self._ensure_dir(chap_dir)
-        
-        data = {
-            "id": chap_id,
+    def _new_chapter(self, title: str, outline: str = ""):
+        return {
+            "id": str(uuid.uuid4())[:8],
             "title": title,
             "outline": outline,
-            "order": order,
+            "order": 0,  # 由后端分配
             "created_at": datetime.now().isoformat()
         }
-        
-        with open(os.path.join(chap_dir, "chapter.json"), "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            
-        return data
+
+    def create_chapter(self, project_name: str, title: str, outline: str = ""):
+        return self.backend.insert_chapter(project_name, self._new_chapter(title, outline))
+
+    def create_chapters(self, project_name: str, items: List[Dict]):
+        """批量创建章节，items 为按顺序排列的 {"title", "outline"}"""
+        records = [self._new_chapter(item["title"], item.get("outline", "")) for item in items]
+        return self.backend.insert_chapters(project_name, records)
 
     def get_chapter(self, project_name: str, chapter_id: str):
-        path = os.path.join(self._get_project_path(project_name), "chapters", chapter_id, "chapter.json")
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        return None
+        return self.backend.get_chapter(project_name, chapter_id)
 
     def update_chapter(self, project_name: str, chapter_id: str, title: str = None, outline: str = None):
-        data = self.get_chapter(project_name, chapter_id)
-        if data:
-            if title is not None: data["title"] = title
-            if outline is not None: data["outline"] = outline
-            
-            path = os.path.join(self._get_project_path(project_name), "chapters", chapter_id, "chapter.json")
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            return data
+        with self._lock:
+            data = self.get_chapter(project_name, chapter_id)
+            if data:
+                if title is not None: data["title"] = title
+                if outline is not None: data["outline"] = outline
+                self.backend.save_chapter(project_name, data)
+                return data
         return None
 
     def delete_chapter(self, project_name: str, chapter_id: str):
-        path = os.path.join(self._get_project_path(project_name), "chapters", chapter_id)
-        if os.path.exists(path):
-            shutil.rmtree(path)
-            # 重新排序剩余章节的 order
-            self._reorder_chapters(project_name)
-            return True
-        return False
-    
-    def _reorder_chapters(self, project_name: str):
-        """重新排序章节的 order 字段"""
-        chapters = self.list_chapters(project_name)
-        for idx, chapter in enumerate(chapters, start=1):
-            if chapter['order'] != idx:
-                chapter['order'] = idx
-                path = os.path.join(self._get_project_path(project_name), "chapters", chapter['id'], "chapter.json")
-                with open(path, "w", encoding="utf-8") as f:
-                    json.dump(chapter, f, ensure_ascii=False, indent=2)
+        with self._lock:
+            self.write_buffer.discard(lambda key: key[:2] == (project_name, chapter_id))
+            # 剩余章节的 order 由后端负责重新排序
+            return self.backend.delete_chapter(project_name, chapter_id)
+
+    def move_chapter(self, project_name: str, chapter_id: str, new_order: int):
+        """移动章节到第 new_order 位，返回移动后的章节"""
+        if self.backend.move_chapter(project_name, chapter_id, new_order):
+            return self.get_chapter(project_name, chapter_id)
+        return None
 
     # --- Section Level ---
+    def _with_pending(self, project_name: str, chapter_id: str, data: dict):
+        """把写回缓冲中尚未落盘的修改叠加到记录上"""
+        if data:
+            pending = self.write_buffer.peek((project_name, chapter_id, data["id"]))
+            if pending:
+                data.update(pending)
+        return data
+
+    def get_section_index(self, project_name: str, chapter_id: str):
+        """返回按顺序排列的小节摘要（id、标题、顺序），不读取小节正文"""
+        entries = self.backend.section_index(project_name, chapter_id)
+        for entry in entries:
+            pending = self.write_buffer.peek((project_name, chapter_id, entry["id"]))
+            if pending and "title" in pending:
+                entry["title"] = pending["title"]
+        return entries
+
     def list_sections(self, project_name: str, chapter_id: str):
-        chap_dir = os.path.join(self._get_project_path(project_name), "chapters", chapter_id)
-        sections_dir = os.path.join(chap_dir, "sections")
-        if not os.path.exists(sections_dir):
-            return []
-            
-        sections = []
-        for sec_id in os.listdir(sections_dir):
-            if sec_id.endswith(".json"):
-                with open(os.path.join(sections_dir, sec_id), "r", encoding="utf-8") as f:
-                    sections.append(json.load(f))
-        
-        sections.sort(key=lambda x: x.get("order", 0))
-        return sections
+        return [self._with_pending(project_name, chapter_id, s) for s in self.backend.list_sections(project_name, chapter_id)]
 
-    def create_section(self, project_name: str, chapter_id: str, title: str, outline: str = ""):
-        chap_dir = os.path.join(self._get_project_path(project_name), "chapters", chapter_id)
-        sections_dir = os.path.join(chap_dir, "sections")
-        self._ensure_dir(sections_dir)
-        
-        existing = self.list_sections(project_name, chapter_id)
-        order = len(existing) + 1
-        
-        sec_id = str(uuid.uuid4())[:8]
-        
-        data = {
-            "id": sec_id,
+    def _new_section(self, chapter_id: str, title: str, outline: str = ""):
+        return {
+            "id": str(uuid.uuid4())[:8],
             "chapter_id": chapter_id,
             "title": title,
             "outline": outline,
             "content": "",
-            "order": order,
+            "order": 0,  # 由后端分配
             "created_at": datetime.now().isoformat()
         }
-        
-        with open(os.path.join(sections_dir, f"{sec_id}.json"), "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            
-        return data
+
+    def create_section(self, project_name: str, chapter_id: str, title: str, outline: str = ""):
+        return self.backend.insert_section(project_name, chapter_id, self._new_section(chapter_id, title, outline))
+
+    def create_sections(self, project_name: str, chapter_id: str, items: List[Dict]):
+        """批量创建小节，items 为按顺序排列的 {"title", "outline"}"""
+        records = [self._new_section(chapter_id, item["title"], item.get("outline", "")) for item in items]
+        return self.backend.insert_sections(project_name, chapter_id, records)
 
     def get_section(self, project_name: str, chapter_id: str, section_id: str):
-        path = os.path.join(self._get_project_path(project_name), "chapters", chapter_id, "sections", f"{section_id}.json")
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        return None
+        return self._with_pending(project_name, chapter_id, self.backend.get_section(project_name, chapter_id, section_id))
 
     def update_section(self, project_name: str, chapter_id: str, section_id: str, title: str = None, outline: str = None, content: str = None):
-        data = self.get_section(project_name, chapter_id, section_id)
-        if data:
-            if title is not None: data["title"] = title
-            if outline is not None: data["outline"] = outline
-            if content is not None: data["content"] = content
-            
-            path = os.path.join(self._get_project_path(project_name), "chapters", chapter_id, "sections", f"{section_id}.json")
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            return data
+        fields = {}
+        if title is not None: fields["title"] = title
+        if outline is not None: fields["outline"] = outline
+        if content is not None: fields["content"] = content
+
+        with self._lock:
+            data = self.get_section(project_name, chapter_id, section_id)
+            if data:
+                data.update(fields)
+                if self.write_buffer.window > 0:
+                    self.write_buffer.stage((project_name, chapter_id, section_id), fields)
+                else:
+                    self.backend.save_section(project_name, chapter_id, data)
+                return data
         return None
-    
+
+    def _flush_section(self, key: tuple):
+        """把一个小节缓冲中的修改写入后端（由定时器或 flush 调用）"""
+        project_name, chapter_id, section_id = key
+        with self._lock:
+            fields = self.write_buffer.pop(key)
+            if not fields:
+                return
+            try:
+                data = self.backend.get_section(project_name, chapter_id, section_id)
+                if data:
+                    data.update(fields)
+                    self.backend.save_section(project_name, chapter_id, data)
+            except Exception as e:
+                # 定时器线程上的异常无人处理，放回缓冲等待重试，避免修改丢失
+                print(f"小节写回失败 {key}: {e}")
+                self.write_buffer.restore(key, fields)
+
+    def flush(self):
+        """立即写入所有缓冲中的小节修改（应用退出时调用）"""
+        for key in self.write_buffer.keys():
+            self._flush_section(key)
+
     def delete_section(self, project_name: str, chapter_id: str, section_id: str):
         """Delete a section"""
-        path = os.path.join(self._get_project_path(project_name), "chapters", chapter_id, "sections", f"{section_id}.json")
-        if os.path.exists(path):
-            os.remove(path)
-            # 重新排序剩余小节的 order
-            self._reorder_sections(project_name, chapter_id)
-            return True
-        return False
-    
-    def _reorder_sections(self, project_name: str, chapter_id: str):
-        """重新排序小节的 order 字段"""
-        sections = self.list_sections(project_name, chapter_id)
-        for idx, section in enumerate(sections, start=1):
-            if section['order'] != idx:
-                section['order'] = idx
-                path = os.path.join(self._get_project_path(project_name), "chapters", chapter_id, "sections", f"{section['id']}.json")
-                with open(path, "w", encoding="utf-8") as f:
-                    json.dump(section, f, ensure_ascii=False, indent=2)
+        with self._lock:
+            self.write_buffer.discard(lambda key: key == (project_name, chapter_id, section_id))
+            # 剩余小节的 order 由后端负责重新排序
+            return self.backend.delete_section(project_name, chapter_id, section_id)
+
+    def move_section(self, project_name: str, chapter_id: str, section_id: str, new_order: int):
+        """移动小节到第 new_order 位，返回移动后的小节"""
+        if self.backend.move_section(project_name, chapter_id, section_id, new_order):
+            return self.get_section(project_name, chapter_id, section_id)
+        return None
 
 novel_store = NovelStore()
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Iterator, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LLMResponseCache:
+    """
+    确定性 LLM 调用的响应缓存（默认关闭，LLM_RESPONSE_CACHE=1 开启）。
+    只用于结果可复现的调用：低温度的标题提取、显式指定 seed 的策划请求。
+    键为 sha256(模型 + 端点 + 消息 + 参数)，存放在本地 SQLite 中，
+    超过 TTL 的条目视为未命中，条目数超过上限时按最近访问时间淘汰。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+    )
+    """
+
+    def __init__(self, db_path: str, ttl: float = 86400, max_entries: int = 1000, enabled: bool = False):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        # 首次使用时才创建数据库文件，未开启缓存时不产生任何文件
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute(self.SCHEMA)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+            self._local.conn = conn
+        return conn
+
+    def make_key(self, llm, messages: list, **params) -> str:
+        """由模型、端点、消息内容和额外参数（seed、extract_type 等）计算缓存键"""
+        payload = {
+            "model": getattr(llm, "model_name", ""),
+            "endpoint": getattr(llm, "openai_api_base", None) or "",
+            "temperature": getattr(llm, "temperature", None),
+            "messages": [[getattr(m, "type", ""), m.content] for m in messages],
+            "params": params,
+        }
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT content, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or (self.ttl and now - row[1] > self.ttl):
+            with self._lock:
+                self.misses += 1
+            return None
+        with conn:
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        with self._lock:
+            self.hits += 1
+        return row[0]
+
+    def put(self, key: str, content: str, model: str = ""):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, content, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, content, now, now)
+            )
+            # 先清理过期条目，再按最近访问时间淘汰超出上限的部分
+            if self.ttl:
+                conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            removed = conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            ).rowcount
+        if removed > 0:
+            with self._lock:
+                self.evictions += removed
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def replay_chunks(content: str, max_chars: int = 32) -> Iterator[str]:
+    """把缓存的完整响应切成小块，模拟流式输出（按行切分，长行再按 max_chars 切）"""
+    for line in content.splitlines(keepends=True):
+        for start in range(0, len(line), max_chars):
+            yield line[start:start + max_chars]
+
+
+# Global instance
+response_cache = LLMResponseCache(
+    db_path=os.getenv("LLM_RESPONSE_CACHE_DB", os.path.join(BASE_DIR, "cache", "llm_responses.sqlite3")),
+    ttl=float(os.getenv("LLM_RESPONSE_CACHE_TTL", "86400")),
+    max_entries=int(os.getenv("LLM_RESPONSE_CACHE_SIZE", "1000")),
+    enabled=os.getenv("LLM_RESPONSE_CACHE", "false").lower() in ("1", "true", "yes"),
+)
@@ -0,0 +1,98 @@
+import os
+import json
+import asyncio
+from typing import AsyncIterator
+
+# orjson 已列入 requirements，用于序列化事件；缺失时（如精简安装）退回标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 默认合并窗口：在该时间内到达的 token 合并为一个 SSE 事件（0 表示逐块发送）
+SSE_COALESCE_MS = int(os.getenv("SSE_COALESCE_MS", "30"))
+# 合并的文本达到该长度时立即发送，不等窗口结束
+SSE_COALESCE_CHARS = int(os.getenv("SSE_COALESCE_CHARS", "256"))
+# 超过该秒数没有事件时发送一条 SSE 注释作为心跳，防止代理因空闲断开连接（0 表示关闭）
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# 心跳帧：以冒号开头的行是 SSE 注释，EventSource 和前端解析器都会忽略
+HEARTBEAT = ": ping\n\n"
+
+
+def dumps(payload) -> str:
+    """把事件序列化为紧凑的 JSON 字符串"""
+    if orjson is not None:
+        return orjson.dumps(payload).decode("utf-8")
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def sse(payload) -> str:
+    """构造一条 SSE data 帧"""
+    return f"data: {dumps(payload)}\n\n"
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_END = object()
+
+
+async def coalesce(source: AsyncIterator[str], window_ms: int = None, max_chars: int = None) -> AsyncIterator[str]:
+    """
+    合并文本块：第一块到达后最多等待 window_ms 毫秒（或累计到 max_chars 个字符），
+    把期间到达的所有块拼接后一次产出。源在独立任务中读取，LLM 停顿时已缓冲的文本也会按时发出。
+    """
+    window_ms = SSE_COALESCE_MS if window_ms is None else window_ms
+    max_chars = max_chars or SSE_COALESCE_CHARS
+    if window_ms <= 0:
+        async for chunk in source:
+            yield chunk
+        return
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for chunk in source:
+                await queue.put(chunk)
+            await queue.put(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(_Failure(e))
+
+    loop = asyncio.get_running_loop()
+    task = asyncio.create_task(pump())
+    parts = []
+    size = 0
+    deadline = 0.0
+    try:
+        while True:
+            if parts:
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    item = None
+            else:
+                item = await queue.get()
+
+            if isinstance(item, str):
+                if not parts:
+                    deadline = loop.time() + window_ms / 1000
+                parts.append(item)
+                size += len(item)
+                if size < max_chars:
+                    continue
+            # 窗口到期、达到长度上限或源结束：发出已合并的文本
+            if parts:
+                yield "".join(parts)
+                parts = []
+                size = 0
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+    finally:
+        task.cancel()
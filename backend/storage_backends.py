@@ -0,0 +1,776 @@
+import os
+import json
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import deepcopy as _copy
+from typing import List, Dict, Optional
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def atomic_write_json(path: str, data):
+    """
+    原子写入 JSON：先写同目录下的临时文件并 fsync，再 os.replace 覆盖目标。
+    进程在写入中途崩溃时，目标文件要么是旧内容，要么是新内容，不会被截断。
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class JsonFileCache:
+    """
+    按路径缓存已解析的 JSON 文件（有界 LRU）。
+    命中时用 os.stat 校验 mtime 和文件大小，外部修改过的文件会被重新读取；
+    经由本进程写入的文件直接更新缓存。默认返回副本，调用方可以放心修改；
+    只读的内部查询可以传 copy=False 直接使用缓存对象。
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _signature(self, path: str):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self, path: str, copy: bool = True):
+        signature = self._signature(path)
+        if signature is None:
+            self.invalidate(path)
+            return None
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached[0] == signature:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return _copy(cached[1]) if copy else cached[1]
+            self.misses += 1
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        self._store(path, signature, data)
+        return _copy(data) if copy else data
+
+    def put(self, path: str, data):
+        """写入文件后调用，用新的文件签名更新缓存"""
+        signature = self._signature(path)
+        if signature is not None:
+            self._store(path, signature, _copy(data))
+
+    def _store(self, path: str, signature, data):
+        with self._lock:
+            self._entries[path] = (signature, data)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, path: str):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def invalidate_prefix(self, prefix: str):
+        """目录被删除时清掉其下所有文件的缓存"""
+        prefix = os.path.join(prefix, "")
+        with self._lock:
+            for path in [p for p in self._entries if p.startswith(prefix)]:
+                del self._entries[path]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class StorageBackend(ABC):
+    """
+    NovelStore 的章节/小节存储后端接口。
+    记录都是普通 dict；新增记录时由后端分配 order（追加到末尾），
+    删除或移动记录后，后端保证返回的 order 仍是从 1 开始的连续序号，
+    且只改动常数条存储记录。
+    """
+
+    @abstractmethod
+    def chapter_index(self, project_name: str) -> List[dict]:
+        """按顺序返回章节摘要（id、title、order）"""
+
+    @abstractmethod
+    def list_chapters(self, project_name: str) -> List[dict]:
+        pass
+
+    @abstractmethod
+    def get_chapter(self, project_name: str, chapter_id: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def insert_chapter(self, project_name: str, data: dict) -> dict:
+        pass
+
+    @abstractmethod
+    def insert_chapters(self, project_name: str, records: List[dict]) -> List[dict]:
+        """按列表顺序批量追加章节，一次性分配 order 并在一轮写入中完成"""
+
+    @abstractmethod
+    def save_chapter(self, project_name: str, data: dict):
+        pass
+
+    @abstractmethod
+    def delete_chapter(self, project_name: str, chapter_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    def move_chapter(self, project_name: str, chapter_id: str, new_order: int) -> bool:
+        """把章节移动到第 new_order 位（从 1 开始，超出范围时放到首/尾）"""
+
+    @abstractmethod
+    def section_index(self, project_name: str, chapter_id: str) -> List[dict]:
+        """按顺序返回小节摘要（id、title、order）"""
+
+    @abstractmethod
+    def list_sections(self, project_name: str, chapter_id: str) -> List[dict]:
+        pass
+
+    @abstractmethod
+    def get_section(self, project_name: str, chapter_id: str, section_id: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def insert_section(self, project_name: str, chapter_id: str, data: dict) -> dict:
+        pass
+
+    @abstractmethod
+    def insert_sections(self, project_name: str, chapter_id: str, records: List[dict]) -> List[dict]:
+        """按列表顺序批量追加小节，一次性分配 order 并在一轮写入中完成"""
+
+    @abstractmethod
+    def save_section(self, project_name: str, chapter_id: str, data: dict):
+        pass
+
+    @abstractmethod
+    def delete_section(self, project_name: str, chapter_id: str, section_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    def move_section(self, project_name: str, chapter_id: str, section_id: str, new_order: int) -> bool:
+        """把小节移动到第 new_order 位（从 1 开始，超出范围时放到首/尾）"""
+
+    @abstractmethod
+    def delete_project(self, project_name: str):
+        """删除项目下的全部章节与小节"""
+
+
+class JsonFileBackend(StorageBackend):
+    """
+    默认后端：data/projects/<name>/chapters/<id>/chapter.json 与 sections/*.json，
+    外加每个项目一个 manifest.json，记录章节/小节的 id、标题、顺序和修改时间，
+    列表和排序只需读一次清单，新增章节/小节也无需重新扫描目录。
+    清单中的先后位置是顺序的唯一依据：删除、移动只改写清单本身，
+    记录文件里的 order 字段仅在读取时按清单位置回填。
+    """
+
+    def __init__(self, data_dir: str, cache: JsonFileCache = None):
+        self.data_dir = data_dir
+        self.cache = cache or JsonFileCache()
+        # 保护清单的“读-改-写”，存储操作会在线程池中并发执行
+        self._lock = threading.RLock()
+
+    def _get_project_path(self, project_name: str):
+        return os.path.join(self.data_dir, project_name)
+
+    def _ensure_dir(self, path):
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _chapter_dir(self, project_name: str, chapter_id: str):
+        return os.path.join(self._get_project_path(project_name), "chapters", chapter_id)
+
+    def _chapter_path(self, project_name: str, chapter_id: str):
+        return os.path.join(self._chapter_dir(project_name, chapter_id), "chapter.json")
+
+    def _section_path(self, project_name: str, chapter_id: str, section_id: str):
+        return os.path.join(self._chapter_dir(project_name, chapter_id), "sections", f"{section_id}.json")
+
+    def _read_json(self, path: str):
+        return self.cache.get(path)
+
+    def _write_json(self, path: str, data):
+        atomic_write_json(path, data)
+        self.cache.put(path, data)
+
+    # --- Manifest ---
+    def _manifest_path(self, project_name: str):
+        return os.path.join(self._get_project_path(project_name), MANIFEST_FILE)
+
+    def _load_manifest(self, project_name: str, readonly: bool = False):
+        # readonly=True 时直接返回缓存中的清单对象，调用方不得修改
+        manifest = self.cache.get(self._manifest_path(project_name), copy=not readonly)
+        if manifest is not None and manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+        with self._lock:
+            return self._rebuild_manifest(project_name)
+
+    def _save_manifest(self, project_name: str, manifest: dict):
+        self._write_json(self._manifest_path(project_name), manifest)
+
+    def _manifest_entry(self, data: dict):
+        return {"id": data["id"], "title": data.get("title", ""), "order": data.get("order", 0), "mtime": time.time()}
+
+    def _rebuild_manifest(self, project_name: str):
+        """扫描目录重建清单（兼容尚无清单的旧项目）"""
+        proj_path = self._get_project_path(project_name)
+        manifest = {"version": MANIFEST_VERSION, "chapters": [], "sections": {}}
+        if not os.path.exists(proj_path):
+            return manifest
+
+        chapters_dir = os.path.join(proj_path, "chapters")
+        if os.path.exists(chapters_dir):
+            for chap_id in os.listdir(chapters_dir):
+                chapter = self._read_json(os.path.join(chapters_dir, chap_id, "chapter.json"))
+                if chapter is None:
+                    continue
+                manifest["chapters"].append(self._manifest_entry(chapter))
+
+                sections_dir = os.path.join(chapters_dir, chap_id, "sections")
+                entries = []
+                if os.path.exists(sections_dir):
+                    for sec_file in os.listdir(sections_dir):
+                        if sec_file.endswith(".json"):
+                            entries.append(self._manifest_entry(self._read_json(os.path.join(sections_dir, sec_file))))
+                entries.sort(key=lambda x: x["order"])
+                self._renumber(entries)
+                manifest["sections"][chap_id] = entries
+
+        manifest["chapters"].sort(key=lambda x: x["order"])
+        self._renumber(manifest["chapters"])
+        self._save_manifest(project_name, manifest)
+        return manifest
+
+    def _renumber(self, entries: List[dict]):
+        """按清单位置刷新 order（仅内存操作）"""
+        for idx, entry in enumerate(entries, start=1):
+            entry["order"] = idx
+
+    def _find_entry(self, entries: List[dict], record_id: str):
+        return next((e for e in entries if e["id"] == record_id), None)
+
+    def _save_if_retitled(self, project_name: str, entry: dict, data: dict, entries_of):
+        """清单只记录 id、标题和顺序：标题未变时不重写清单，自动保存只写记录文件本身"""
+        if entry["title"] == data.get("title", ""):
+            return
+        manifest = self._load_manifest(project_name)
+        self._touch_entry(entries_of(manifest), data)
+        self._save_manifest(project_name, manifest)
+
+    def _touch_entry(self, entries: List[dict], data: dict):
+        for entry in entries:
+            if entry["id"] == data["id"]:
+                entry["title"] = data.get("title", "")
+                entry["mtime"] = time.time()
+                return
+
+    def _order_of(self, entries: List[dict], record_id: str):
+        return next((e["order"] for e in entries if e["id"] == record_id), 0)
+
+    def _move_entry(self, entries: List[dict], record_id: str, new_order: int):
+        idx = next((i for i, e in enumerate(entries) if e["id"] == record_id), None)
+        if idx is None:
+            return False
+        entry = entries.pop(idx)
+        position = min(max(new_order, 1), len(entries) + 1) - 1
+        entries.insert(position, entry)
+        entry["mtime"] = time.time()
+        self._renumber(entries)
+        return True
+
+    # --- Chapter Level ---
+    def chapter_index(self, project_name: str):
+        return [dict(e) for e in self._load_manifest(project_name, readonly=True)["chapters"]]
+
+    def list_chapters(self, project_name: str):
+        chapters = []
+        for entry in self._load_manifest(project_name, readonly=True)["chapters"]:
+            chapter = self._read_json(self._chapter_path(project_name, entry["id"]))
+            if chapter is not None:
+                chapter["order"] = entry["order"]
+                chapters.append(chapter)
+        return chapters
+
+    def get_chapter(self, project_name: str, chapter_id: str):
+        chapter = self._read_json(self._chapter_path(project_name, chapter_id))
+        if chapter is not None:
+            chapter["order"] = self._order_of(self._load_manifest(project_name, readonly=True)["chapters"], chapter_id)
+        return chapter
+
+    def insert_chapter(self, project_name: str, data: dict):
+        return self.insert_chapters(project_name, [data])[0]
+
+    def insert_chapters(self, project_name: str, records: List[dict]):
+        with self._lock:
+            manifest = self._load_manifest(project_name)
+            start = len(manifest["chapters"])
+            for idx, data in enumerate(records, start=start + 1):
+                data["order"] = idx
+                self._ensure_dir(self._chapter_dir(project_name, data["id"]))
+                self._write_json(self._chapter_path(project_name, data["id"]), data)
+                manifest["chapters"].append(self._manifest_entry(data))
+                manifest["sections"][data["id"]] = []
+            self._save_manifest(project_name, manifest)
+        return records
+
+    def save_chapter(self, project_name: str, data: dict):
+        with self._lock:
+            self._write_json(self._chapter_path(project_name, data["id"]), data)
+            entry = self._find_entry(self._load_manifest(project_name, readonly=True)["chapters"], data["id"])
+            if entry is not None:
+                self._save_if_retitled(project_name, entry, data, lambda m: m["chapters"])
+
+    def delete_chapter(self, project_name: str, chapter_id: str):
+        path = self._chapter_dir(project_name, chapter_id)
+        with self._lock:
+            if not os.path.exists(path):
+                return False
+            shutil.rmtree(path)
+            self.cache.invalidate_prefix(path)
+            manifest = self._load_manifest(project_name)
+            manifest["chapters"] = [c for c in manifest["chapters"] if c["id"] != chapter_id]
+            manifest["sections"].pop(chapter_id, None)
+            # 剩余章节的 order 只在清单中重排，不改写章节文件
+            self._renumber(manifest["chapters"])
+            self._save_manifest(project_name, manifest)
+            return True
+
+    def move_chapter(self, project_name: str, chapter_id: str, new_order: int):
+        with self._lock:
+            manifest = self._load_manifest(project_name)
+            if not self._move_entry(manifest["chapters"], chapter_id, new_order):
+                return False
+            self._save_manifest(project_name, manifest)
+            return True
+
+    # --- Section Level ---
+    def _section_entries(self, project_name: str, chapter_id: str):
+        return self._load_manifest(project_name, readonly=True)["sections"].get(chapter_id, [])
+
+    def section_index(self, project_name: str, chapter_id: str):
+        return [dict(e) for e in self._section_entries(project_name, chapter_id)]
+
+    def list_sections(self, project_name: str, chapter_id: str):
+        sections = []
+        for entry in self._section_entries(project_name, chapter_id):
+            section = self._read_json(self._section_path(project_name, chapter_id, entry["id"]))
+            if section is not None:
+                section["order"] = entry["order"]
+                sections.append(section)
+        return sections
+
+    def get_section(self, project_name: str, chapter_id: str, section_id: str):
+        section = self._read_json(self._section_path(project_name, chapter_id, section_id))
+        if section is not None:
+            section["order"] = self._order_of(self._section_entries(project_name, chapter_id), section_id)
+        return section
+
+    def insert_section(self, project_name: str, chapter_id: str, data: dict):
+        return self.insert_sections(project_name, chapter_id, [data])[0]
+
+    def insert_sections(self, project_name: str, chapter_id: str, records: List[dict]):
+        with self._lock:
+            self._ensure_dir(os.path.join(self._chapter_dir(project_name, chapter_id), "sections"))
+            manifest = self._load_manifest(project_name)
+            entries = manifest["sections"].setdefault(chapter_id, [])
+            for idx, data in enumerate(records, start=len(entries) + 1):
+                data["order"] = idx
+                self._write_json(self._section_path(project_name, chapter_id, data["id"]), data)
+                entries.append(self._manifest_entry(data))
+            self._save_manifest(project_name, manifest)
+        return records
+
+    def save_section(self, project_name: str, chapter_id: str, data: dict):
+        with self._lock:
+            manifest = self._load_manifest(project_name, readonly=True)
+            entry = self._find_entry(manifest["sections"].get(chapter_id, []), data["id"])
+            # 已删除的小节不再写回，否则会留下不在清单中的孤立文件
+            if entry is None:
+                return
+            self._write_json(self._section_path(project_name, chapter_id, data["id"]), data)
+            self._save_if_retitled(project_name, entry, data, lambda m: m["sections"].get(chapter_id, []))
+
+    def delete_section(self, project_name: str, chapter_id: str, section_id: str):
+        path = self._section_path(project_name, chapter_id, section_id)
+        with self._lock:
+            if not os.path.exists(path):
+                return False
+            os.remove(path)
+            self.cache.invalidate(path)
+            manifest = self._load_manifest(project_name)
+            entries = [s for s in manifest["sections"].get(chapter_id, []) if s["id"] != section_id]
+            # 剩余小节的 order 只在清单中重排，不改写小节文件
+            self._renumber(entries)
+            manifest["sections"][chapter_id] = entries
+            self._save_manifest(project_name, manifest)
+            return True
+
+    def move_section(self, project_name: str, chapter_id: str, section_id: str, new_order: int):
+        with self._lock:
+            manifest = self._load_manifest(project_name)
+            if not self._move_entry(manifest["sections"].get(chapter_id, []), section_id, new_order):
+                return False
+            self._save_manifest(project_name, manifest)
+            return True
+
+    def delete_project(self, project_name: str):
+        # 章节目录随项目目录一起由 NovelStore 删除，这里只清缓存
+        self.cache.invalidate_prefix(self._get_project_path(project_name))
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    SQLite 后端：章节和小节各一张表，(project, chapter, ord) 建索引，开启 WAL 以便读写并发。
+    ord 是带间隙的排序键（浮点数），对外的 order 由排名实时计算：
+    删除不需要重排，插入到中间或拖拽移动只更新被移动的那一行，
+    只有相邻排序键的间隙耗尽时才在一个事务内整体重新编号。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS chapters (
+        project TEXT NOT NULL,
+        id TEXT NOT NULL,
+        ord REAL NOT NULL,
+        title TEXT NOT NULL DEFAULT '',
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (project, id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_chapters_order ON chapters (project, ord);
+    CREATE TABLE IF NOT EXISTS sections (
+        project TEXT NOT NULL,
+        chapter_id TEXT NOT NULL,
+        id TEXT NOT NULL,
+        ord REAL NOT NULL,
+        title TEXT NOT NULL DEFAULT '',
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (project, chapter_id, id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_sections_order ON sections (project, chapter_id, ord);
+    """
+
+    # 同一范围内排序键唯一；旧数据库中已有重复键时先重新编号再建索引
+    UNIQUE_ORDER_INDEXES = {
+        "chapters": ("idx_chapters_order_unique", "project", ("project",)),
+        "sections": ("idx_sections_order_unique", "project, chapter_id", ("project", "chapter_id")),
+    }
+
+    # 相邻排序键的最小间隙，低于该值时重新编号
+    MIN_GAP = 1e-9
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        # 每个线程一个连接（存储操作在线程池中执行）
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(self.SCHEMA)
+        self._ensure_unique_order()
+
+    def _ensure_unique_order(self):
+        for table, (index, columns, scope_columns) in self.UNIQUE_ORDER_INDEXES.items():
+            with self._write() as conn:
+                try:
+                    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {table} ({columns}, ord)")
+                except sqlite3.IntegrityError:
+                    where = " AND ".join(f"{c} = ?" for c in scope_columns)
+                    for args in conn.execute(f"SELECT DISTINCT {columns} FROM {table}").fetchall():
+                        self._renumber(conn, table, where, tuple(args))
+                    conn.execute(f"CREATE UNIQUE INDEX {index} ON {table} ({columns}, ord)")
+
+    @contextmanager
+    def _write(self):
+        """
+        写事务。sqlite3 默认要到第一条写语句才开启事务，先读排序键再插入的操作会与其他连接交错；
+        BEGIN IMMEDIATE 在事务开始时就取得写锁，读写之间不会插入其他写操作。
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _row_to_record(self, row):
+        data = json.loads(row[0])
+        data["order"] = row[1]
+        return data
+
+    def _scope(self, table: str, project_name: str, chapter_id: str = None):
+        """返回 (WHERE 子句, 参数)，限定到一个项目的章节或一个章节的小节"""
+        if table == "chapters":
+            return "project = ?", (project_name,)
+        return "project = ? AND chapter_id = ?", (project_name, chapter_id)
+
+    def _index(self, table: str, project_name: str, chapter_id: str = None):
+        where, args = self._scope(table, project_name, chapter_id)
+        rows = self._conn().execute(
+            f"SELECT id, title, ROW_NUMBER() OVER (ORDER BY ord), updated_at FROM {table} WHERE {where} ORDER BY ord",
+            args
+        ).fetchall()
+        return [{"id": r[0], "title": r[1], "order": r[2], "mtime": r[3]} for r in rows]
+
+    def _list(self, table: str, project_name: str, chapter_id: str = None):
+        where, args = self._scope(table, project_name, chapter_id)
+        rows = self._conn().execute(
+            f"SELECT data, ROW_NUMBER() OVER (ORDER BY ord) FROM {table} WHERE {where} ORDER BY ord",
+            args
+        ).fetchall()
+        return [self._row_to_record(r) for r in rows]
+
+    def _get(self, table: str, record_id: str, project_name: str, chapter_id: str = None):
+        where, args = self._scope(table, project_name, chapter_id)
+        row = self._conn().execute(
+            f"SELECT data, ord FROM {table} WHERE {where} AND id = ?",
+            args + (record_id,)
+        ).fetchone()
+        if not row:
+            return None
+        # 排名 = 排序键不大于自身的记录数（走 (project, [chapter_id,] ord) 索引）
+        (rank,) = self._conn().execute(
+            f"SELECT COUNT(*) FROM {table} WHERE {where} AND ord <= ?",
+            args + (row[1],)
+        ).fetchone()
+        return self._row_to_record((row[0], rank))
+
+    def _next_key(self, conn, table: str, where: str, args: tuple):
+        max_key, count = conn.execute(f"SELECT MAX(ord), COUNT(*) FROM {table} WHERE {where}", args).fetchone()
+        return (max_key or 0) + 1, count + 1
+
+    def _move(self, table: str, record_id: str, new_order: int, project_name: str, chapter_id: str = None):
+        where, args = self._scope(table, project_name, chapter_id)
+        # 相邻键的读取与更新在同一个写事务中，并发移动不会算出相同的中点或交错重新编号
+        with self._write() as conn:
+            if not conn.execute(f"SELECT 1 FROM {table} WHERE {where} AND id = ?", args + (record_id,)).fetchone():
+                return False
+            key = self._key_at(conn, table, where, args, record_id, new_order)
+            if key is None:
+                self._renumber(conn, table, where, args)
+                key = self._key_at(conn, table, where, args, record_id, new_order)
+            conn.execute(
+                f"UPDATE {table} SET ord = ?, updated_at = ? WHERE {where} AND id = ?",
+                (key, time.time()) + args + (record_id,)
+            )
+        return True
+
+    def _key_at(self, conn, table: str, where: str, args: tuple, record_id: str, new_order: int):
+        """计算把记录放到第 new_order 位所需的排序键；间隙耗尽时返回 None"""
+        position = max(new_order, 1) - 1
+        others = f"{where} AND id != ?"
+        neighbours = conn.execute(
+            f"SELECT ord FROM {table} WHERE {others} ORDER BY ord LIMIT 2 OFFSET ?",
+            args + (record_id, max(position - 1, 0))
+        ).fetchall()
+        if position == 0:
+            prev_key, next_key = None, (neighbours[0][0] if neighbours else None)
+        else:
+            prev_key = neighbours[0][0] if neighbours else None
+            next_key = neighbours[1][0] if len(neighbours) > 1 else None
+            if prev_key is None:
+                # 超出末尾：放到最后
+                (prev_key,) = conn.execute(f"SELECT MAX(ord) FROM {table} WHERE {others}", args + (record_id,)).fetchone()
+
+        if prev_key is None and next_key is None:
+            return 1.0
+        if prev_key is None:
+            return next_key - 1
+        if next_key is None:
+            return prev_key + 1
+        key = (prev_key + next_key) / 2
+        # 间隙低于浮点精度时中点会等于某个相邻键
+        if next_key - prev_key < self.MIN_GAP or not prev_key < key < next_key:
+            return None
+        return key
+
+    def _renumber(self, conn, table: str, where: str, args: tuple):
+        """把排序键重新编号为 1..N（在调用方的事务中执行）"""
+        ids = [r[0] for r in conn.execute(f"SELECT id FROM {table} WHERE {where} ORDER BY ord, rowid", args)]
+        (max_key,) = conn.execute(f"SELECT MAX(ord) FROM {table} WHERE {where}", args).fetchone()
+        # 先整体移到现有键之上，再写回 1..N，逐行更新时不会违反唯一索引
+        base = max(max_key or 0, len(ids)) + 1
+        for offset in (base, 0):
+            conn.executemany(
+                f"UPDATE {table} SET ord = ? WHERE {where} AND id = ?",
+                [(offset + idx,) + args + (record_id,) for idx, record_id in enumerate(ids, start=1)]
+            )
+
+    # --- Chapter Level ---
+    def chapter_index(self, project_name: str):
+        return self._index("chapters", project_name)
+
+    def list_chapters(self, project_name: str):
+        return self._list("chapters", project_name)
+
+    def get_chapter(self, project_name: str, chapter_id: str):
+        return self._get("chapters", chapter_id, project_name)
+
+    def insert_chapter(self, project_name: str, data: dict):
+        return self.insert_chapters(project_name, [data])[0]
+
+    def insert_chapters(self, project_name: str, records: List[dict]):
+        now = time.time()
+        with self._write() as conn:
+            key, order = self._next_key(conn, "chapters", *self._scope("chapters", project_name))
+            rows = []
+            for idx, data in enumerate(records):
+                data["order"] = order + idx
+                rows.append((project_name, data["id"], key + idx, data.get("title", ""), json.dumps(data, ensure_ascii=False), now))
+            conn.executemany(
+                "INSERT INTO chapters (project, id, ord, title, data, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        return records
+
+    def save_chapter(self, project_name: str, data: dict):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE chapters SET title = ?, data = ?, updated_at = ? WHERE project = ? AND id = ?",
+                (data.get("title", ""), json.dumps(data, ensure_ascii=False), time.time(), project_name, data["id"])
+            )
+
+    def delete_chapter(self, project_name: str, chapter_id: str):
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute("DELETE FROM chapters WHERE project = ? AND id = ?", (project_name, chapter_id))
+            if cursor.rowcount == 0:
+                return False
+            conn.execute("DELETE FROM sections WHERE project = ? AND chapter_id = ?", (project_name, chapter_id))
+        return True
+
+    def move_chapter(self, project_name: str, chapter_id: str, new_order: int):
+        return self._move("chapters", chapter_id, new_order, project_name)
+
+    # --- Section Level ---
+    def section_index(self, project_name: str, chapter_id: str):
+        return self._index("sections", project_name, chapter_id)
+
+    def list_sections(self, project_name: str, chapter_id: str):
+        return self._list("sections", project_name, chapter_id)
+
+    def get_section(self, project_name: str, chapter_id: str, section_id: str):
+        return self._get("sections", section_id, project_name, chapter_id)
+
+    def insert_section(self, project_name: str, chapter_id: str, data: dict):
+        return self.insert_sections(project_name, chapter_id, [data])[0]
+
+    def insert_sections(self, project_name: str, chapter_id: str, records: List[dict]):
+        now = time.time()
+        with self._write() as conn:
+            key, order = self._next_key(conn, "sections", *self._scope("sections", project_name, chapter_id))
+            rows = []
+            for idx, data in enumerate(records):
+                data["order"] = order + idx
+                rows.append((project_name, chapter_id, data["id"], key + idx, data.get("title", ""), json.dumps(data, ensure_ascii=False), now))
+            conn.executemany(
+                "INSERT INTO sections (project, chapter_id, id, ord, title, data, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        return records
+
+    def save_section(self, project_name: str, chapter_id: str, data: dict):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE sections SET title = ?, data = ?, updated_at = ? WHERE project = ? AND chapter_id = ? AND id = ?",
+                (data.get("title", ""), json.dumps(data, ensure_ascii=False), time.time(), project_name, chapter_id, data["id"])
+            )
+
+    def delete_section(self, project_name: str, chapter_id: str, section_id: str):
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM sections WHERE project = ? AND chapter_id = ? AND id = ?",
+                (project_name, chapter_id, section_id)
+            )
+        return cursor.rowcount > 0
+
+    def move_section(self, project_name: str, chapter_id: str, section_id: str, new_order: int):
+        return self._move("sections", section_id, new_order, project_name, chapter_id)
+
+    def delete_project(self, project_name: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM sections WHERE project = ?", (project_name,))
+            conn.execute("DELETE FROM chapters WHERE project = ?", (project_name,))
+
+    def import_project(self, project_name: str, chapters: List[dict], sections: Dict[str, List[dict]]):
+        """在一个事务中用给定记录替换项目的全部章节与小节（保留原有顺序）"""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM sections WHERE project = ?", (project_name,))
+            conn.execute("DELETE FROM chapters WHERE project = ?", (project_name,))
+            for idx, chapter in enumerate(chapters, start=1):
+                chapter["order"] = idx
+                conn.execute(
+                    "INSERT INTO chapters (project, id, ord, title, data, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (project_name, chapter["id"], idx, chapter.get("title", ""), json.dumps(chapter, ensure_ascii=False), now)
+                )
+                for sec_idx, section in enumerate(sections.get(chapter["id"], []), start=1):
+                    section["order"] = sec_idx
+                    conn.execute(
+                        "INSERT INTO sections (project, chapter_id, id, ord, title, data, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (project_name, chapter["id"], section["id"], sec_idx, section.get("title", ""), json.dumps(section, ensure_ascii=False), now)
+                    )
+
+
+def create_backend(data_dir: str, cache: JsonFileCache = None) -> StorageBackend:
+    """根据 NOVEL_STORE_BACKEND 环境变量选择存储后端（json / sqlite）"""
+    kind = os.getenv("NOVEL_STORE_BACKEND", "json").lower()
+    if kind == "sqlite":
+        db_path = os.getenv("NOVEL_STORE_DB", os.path.join(os.path.dirname(data_dir), "novel_store.sqlite3"))
+        return SQLiteBackend(db_path)
+    if kind != "json":
+        raise ValueError(f"Unknown storage backend: {kind}")
+    return JsonFileBackend(data_dir, cache)
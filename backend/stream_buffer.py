@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from collections import deque
+from typing import AsyncGenerator, Dict, Optional, Tuple
+
+# 每个流在内存中保留的最近事件数
+STREAM_BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", "4096"))
+# 流结束后缓冲区保留的秒数，期间断线重连仍可补发
+STREAM_GRACE_SECONDS = float(os.getenv("STREAM_GRACE_SECONDS", "120"))
+# 所有客户端断开后等待重连的秒数，超时仍无人订阅则取消生成（连同上游 LLM 请求）
+STREAM_ORPHAN_SECONDS = float(os.getenv("STREAM_ORPHAN_SECONDS", "10"))
+
+
+def parse_event_id(value: Optional[str]) -> Tuple[Optional[str], int]:
+    """解析 Last-Event-ID（格式 "<stream_id>:<seq>"），返回 (stream_id, seq)；无法解析时 seq 为 -1"""
+    if not value or ":" not in value:
+        return None, -1
+    stream_id, _, seq = value.rpartition(":")
+    try:
+        return stream_id, int(seq)
+    except ValueError:
+        return None, -1
+
+
+class BufferedStream:
+    """
+    一条可续传的 SSE 流。生产者在后台任务中运行，与客户端连接解耦；
+    每个事件带递增序号存入有界环形缓冲区，订阅者可从任意仍在缓冲区内的序号之后继续读取。
+    """
+
+    def __init__(self, stream_id: str, max_events: int):
+        self.id = stream_id
+        self.events = deque(maxlen=max_events)
+        self.next_seq = 0
+        self.finished = False
+        self.finished_at: Optional[float] = None
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+        self.consumers = 0
+        self.cancelled = False
+        self.orphan_timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def first_seq(self) -> int:
+        return self.next_seq - len(self.events)
+
+    def can_resume(self, after_seq: int) -> bool:
+        """after_seq 之后的事件是否都还在缓冲区中"""
+        return after_seq + 1 >= self.first_seq
+
+    async def append(self, payload: str):
+        async with self.changed:
+            self.events.append(payload)
+            self.next_seq += 1
+            self.changed.notify_all()
+
+    async def finish(self):
+        async with self.changed:
+            self.finished = True
+            self.finished_at = time.monotonic()
+            self.changed.notify_all()
+
+    async def replay(self, after_seq: int = -1, heartbeat: float = None) -> AsyncGenerator[Tuple[Optional[int], Optional[str]], None]:
+        """
+        产出 after_seq 之后的 (序号, 事件)，流未结束时持续等待新事件。
+        指定 heartbeat 时，超过该秒数没有新事件会产出一次 (None, None)，供调用方发送心跳。
+        """
+        seq = after_seq + 1
+        while True:
+            async with self.changed:
+                try:
+                    await asyncio.wait_for(self.changed.wait_for(lambda: self.next_seq > seq or self.finished), heartbeat)
+                except asyncio.TimeoutError:
+                    idle = True
+                else:
+                    idle = False
+            if idle:
+                yield None, None
+                continue
+            async with self.changed:
+                # 订阅者落后太多时，所需事件已被环形缓冲区覆盖
+                overflow = seq < self.first_seq
+                first = self.first_seq
+                batch = [] if overflow else [(s, self.events[s - first]) for s in range(seq, self.next_seq)]
+                done = self.finished
+            if overflow:
+                yield seq, json.dumps({"error": "stream buffer overflow", "resume_from": first})
+                return
+            for item in batch:
+                yield item
+            seq += len(batch)
+            if done:
+                return
+
+
+class StreamRegistry:
+    """按 stream_id 管理可续传的流，结束超过宽限期的流在下次访问时清理"""
+
+    def __init__(self, max_events: int = STREAM_BUFFER_SIZE, grace_seconds: float = STREAM_GRACE_SECONDS):
+        self.max_events = max_events
+        self.grace_seconds = grace_seconds
+        self._streams: Dict[str, BufferedStream] = {}
+        self.orphan_seconds = STREAM_ORPHAN_SECONDS
+        self.started = 0
+        self.resumed = 0
+        self.replayed_events = 0
+        self.cancelled = 0
+
+    def _sweep(self):
+        now = time.monotonic()
+        expired = [sid for sid, s in self._streams.items() if s.finished and now - s.finished_at > self.grace_seconds]
+        for sid in expired:
+            self._streams.pop(sid, None)
+
+    def start(self, source: AsyncGenerator[str, None]) -> BufferedStream:
+        """在后台运行 SSE 帧生成器（如 event_generator），把每一帧的 data 部分写入新流"""
+        self._sweep()
+        stream = BufferedStream(uuid.uuid4().hex[:16], self.max_events)
+
+        async def produce():
+            try:
+                async for frame in source:
+                    payload = frame[len("data: "):].strip() if frame.startswith("data: ") else frame.strip()
+                    await stream.append(payload)
+            except Exception as e:
+                await stream.append(json.dumps({"error": str(e)}))
+                await stream.append("[DONE]")
+            finally:
+                await stream.finish()
+
+        stream.task = asyncio.create_task(produce())
+        self._streams[stream.id] = stream
+        self.started += 1
+        # 客户端在开始读取前就已断开时同样需要回收
+        self._schedule_orphan_check(stream)
+        return stream
+
+    def attach(self, stream: BufferedStream):
+        """登记一个正在读取该流的客户端，并撤销待执行的取消计时"""
+        stream.consumers += 1
+        if stream.orphan_timer is not None:
+            stream.orphan_timer.cancel()
+            stream.orphan_timer = None
+
+    def detach(self, stream: BufferedStream):
+        """客户端断开（或读取结束）；最后一个客户端离开且流未结束时开始计时"""
+        stream.consumers = max(0, stream.consumers - 1)
+        if stream.consumers == 0 and not stream.finished:
+            self._schedule_orphan_check(stream)
+
+    def _schedule_orphan_check(self, stream: BufferedStream):
+        if stream.orphan_timer is not None:
+            stream.orphan_timer.cancel()
+        stream.orphan_timer = asyncio.get_running_loop().call_later(max(0.0, self.orphan_seconds), self._cancel_if_orphaned, stream)
+
+    def _cancel_if_orphaned(self, stream: BufferedStream):
+        stream.orphan_timer = None
+        if stream.consumers == 0 and not stream.finished and stream.task and not stream.task.done():
+            print(f"流 {stream.id} 无客户端订阅，取消生成")
+            stream.cancelled = True
+            stream.task.cancel()
+            self.cancelled += 1
+
+    def get(self, stream_id: str) -> Optional[BufferedStream]:
+        self._sweep()
+        return self._streams.get(stream_id)
+
+    def record_resume(self, stream: BufferedStream, after_seq: int):
+        self.resumed += 1
+        self.replayed_events += max(0, stream.next_seq - (after_seq + 1))
+
+    def stats(self):
+        self._sweep()
+        return {
+            "active": sum(1 for s in self._streams.values() if not s.finished),
+            "buffered": len(self._streams),
+            "started": self.started,
+            "resumed": self.resumed,
+            "replayed_events": self.replayed_events,
+            "cancelled": self.cancelled,
+        }
+
+    async def aclose(self):
+        """取消所有仍在运行的生产者（应用退出时调用）"""
+        tasks = [s.task for s in self._streams.values() if s.task and not s.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._streams.clear()
+
+
+# Global instance
+stream_registry = StreamRegistry()
@@ -146,20 +146,17 @@ export default function ChapterPage() {
         return;
       }
 
-      // 批量创建小节
-      for (const title of titles) {
-        if (title.trim()) {
-          try {
-            await fetch(`http://localhost:8000/api/projects/${projectName}/chapters/${chapterId}/sections`, {
-              method: 'POST',
-              headers: { 'Content-Type': 'application/json' },
-              body: JSON.stringify({ title: title.trim(), outline: '' })
-            });
-          } catch (error) {
-            console.error(`Failed to create section: ${title}`, error);
-          }
-        }
-      }
+      // 批量创建小节（一次请求）
+      const sections = titles
+        .map((title: string) => title.trim())
+        .filter((title: string) => title)
+        .map((title: string) => ({ title, outline: '' }));
+      const batchRes = await fetch(`http://localhost:8000/api/projects/${projectName}/chapters/${chapterId}/sections/batch`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ sections })
+      });
+      if (!batchRes.ok) console.error('Failed to create sections', await batchRes.text());
 
       fetchChapterData();
     } catch (error) {
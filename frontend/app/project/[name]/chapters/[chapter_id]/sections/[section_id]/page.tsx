@@ -3,6 +3,7 @@
 import { useState, useEffect, useRef } from 'react';
 import Link from 'next/link';
 import { useParams } from 'next/navigation';
+import { streamChat } from '@/lib/chatStream';
 
 interface Section {
   id: string;
@@ -108,51 +109,21 @@ export default function SectionPage() {
     const prompt = section?.title || '撰写本节内容';
 
     try {
-      const response = await fetch('http://localhost:8000/api/chat', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ 
-            agent: 'planner',
-            topic: prompt, 
-            project_name: projectName,
-            granularity: "section",
-            current_chapter: chapterId,
-            current_section: sectionId
-        }),
-      });
-
-      if (!response.ok) throw new Error('Network response was not ok');
-
-      const reader = response.body?.getReader();
-      const decoder = new TextDecoder();
-      if (!reader) return;
-
-      while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
-
-        const chunk = decoder.decode(value);
-        const lines = chunk.split('\n\n');
-
-        for (const line of lines) {
-          if (line.startsWith('data: ')) {
-            const dataStr = line.replace('data: ', '');
-            if (dataStr === '[DONE]') break;
-            
-            try {
-              const data = JSON.parse(dataStr);
-              if (data.type === 'stream' && data.agent === 'planner') {
-                setAgentOutput(prev => ({
-                  ...prev,
-                  planner: prev.planner + data.content
-                }));
-              }
-            } catch (e) {
-              console.error('Error parsing JSON', e);
-            }
-          }
+      await streamChat({
+        agent: 'planner',
+        topic: prompt,
+        project_name: projectName,
+        granularity: "section",
+        current_chapter: chapterId,
+        current_section: sectionId
+      }, (data) => {
+        if (data.type === 'stream' && data.agent === 'planner') {
+          setAgentOutput(prev => ({
+            ...prev,
+            planner: prev.planner + data.content
+          }));
         }
-      }
+      });
     } catch (error) {
       console.error('Error:', error);
       alert('架构生成出错: ' + error);
@@ -184,53 +155,23 @@ export default function SectionPage() {
     }
 
     try {
-      const response = await fetch('http://localhost:8000/api/chat', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          agent: 'writer',
-          topic: agentOutput.planner,
-          project_name: projectName,
-          granularity: "section",
-          section_outline: agentOutput.planner,
-          critique: requestBody.critique || '',
-          current_chapter: chapterId,
-          current_section: sectionId
-        }),
-      });
-
-      if (!response.ok) throw new Error('Network response was not ok');
-
-      const reader = response.body?.getReader();
-      const decoder = new TextDecoder();
-      if (!reader) return;
-
-      while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
-
-        const chunk = decoder.decode(value);
-        const lines = chunk.split('\n\n');
-
-        for (const line of lines) {
-          if (line.startsWith('data: ')) {
-            const dataStr = line.replace('data: ', '');
-            if (dataStr === '[DONE]') break;
-            
-            try {
-              const data = JSON.parse(dataStr);
-              if (data.type === 'stream' && data.agent === 'writer') {
-                setAgentOutput(prev => ({
-                  ...prev,
-                  writer: prev.writer + data.content
-                }));
-              }
-            } catch (e) {
-              console.error('Error parsing JSON', e);
-            }
-          }
+      await streamChat({
+        agent: 'writer',
+        topic: agentOutput.planner,
+        project_name: projectName,
+        granularity: "section",
+        section_outline: agentOutput.planner,
+        critique: requestBody.critique || '',
+        current_chapter: chapterId,
+        current_section: sectionId
+      }, (data) => {
+        if (data.type === 'stream' && data.agent === 'writer') {
+          setAgentOutput(prev => ({
+            ...prev,
+            writer: prev.writer + data.content
+          }));
         }
-      }
+      });
     } catch (error) {
       console.error('Error:', error);
       alert('正文生成出错: ' + error);
@@ -249,52 +190,22 @@ export default function SectionPage() {
     setAgentOutput(prev => ({ ...prev, reviewer: '' }));
 
     try {
-      const response = await fetch('http://localhost:8000/api/chat', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ 
-            agent: 'reviewer',
-            topic: agentOutput.writer,
-            project_name: projectName,
-            granularity: "section",
-            draft: agentOutput.writer,
-            current_chapter: chapterId,
-            current_section: sectionId
-        }),
-      });
-
-      if (!response.ok) throw new Error('Network response was not ok');
-
-      const reader = response.body?.getReader();
-      const decoder = new TextDecoder();
-      if (!reader) return;
-
-      while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
-
-        const chunk = decoder.decode(value);
-        const lines = chunk.split('\n\n');
-
-        for (const line of lines) {
-          if (line.startsWith('data: ')) {
-            const dataStr = line.replace('data: ', '');
-            if (dataStr === '[DONE]') break;
-            
-            try {
-              const data = JSON.parse(dataStr);
-              if (data.type === 'stream' && data.agent === 'reviewer') {
-                setAgentOutput(prev => ({
-                  ...prev,
-                  reviewer: prev.reviewer + data.content
-                }));
-              }
-            } catch (e) {
-              console.error('Error parsing JSON', e);
-            }
-          }
+      await streamChat({
+        agent: 'reviewer',
+        topic: agentOutput.writer,
+        project_name: projectName,
+        granularity: "section",
+        draft: agentOutput.writer,
+        current_chapter: chapterId,
+        current_section: sectionId
+      }, (data) => {
+        if (data.type === 'stream' && data.agent === 'reviewer') {
+          setAgentOutput(prev => ({
+            ...prev,
+            reviewer: prev.reviewer + data.content
+          }));
         }
-      }
+      });
     } catch (error) {
       console.error('Error:', error);
       alert('评论生成出错: ' + error);
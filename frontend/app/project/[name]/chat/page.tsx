@@ -3,6 +3,7 @@
 import { useState, useEffect, useRef } from 'react';
 import Link from 'next/link';
 import { useParams, useSearchParams } from 'next/navigation';
+import { streamChat } from '@/lib/chatStream';
 
 interface AgentData {
   novel_outline?: string;
@@ -97,102 +98,67 @@ export default function ChatPage() {
     setIsLoading(true);
 
     try {
-      const response = await fetch('http://localhost:8000/api/chat', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ 
-          topic: currentTopic, 
-          project_name: projectName,
-          granularity: mode === 'chapter' ? 'chapter' : 'novel',
-          chapter_title: mode === 'chapter' ? (chapterInfo?.title || '') : ''
-        }),
-      });
-
-      if (!response.ok) throw new Error('Network response was not ok');
-
-      const reader = response.body?.getReader();
-      const decoder = new TextDecoder();
-
-      if (!reader) return;
-
-      while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
-
-        const chunk = decoder.decode(value);
-        const lines = chunk.split('\n\n');
-
-        for (const line of lines) {
-          if (line.startsWith('data: ')) {
-            const dataStr = line.replace('data: ', '');
-            if (dataStr === '[DONE]') break;
-            
-            try {
-              const data = JSON.parse(dataStr);
-              
-              setMessages((prev) => {
-                const lastMsg = prev[prev.length - 1];
-                
-                // 1. Handle Streaming Content
-                if (data.type === 'stream') {
-                    // Check if we can append to the last message
-                    if (lastMsg && lastMsg.agent === data.agent && !lastMsg.isFinal) {
-                        const newData = { ...lastMsg.data };
-                        
-                        // Append content to the correct field based on agent
-                        if (data.agent === 'planner') {
-                            newData.novel_outline = (newData.novel_outline || '') + data.content;
-                        } else if (data.agent === 'writer') {
-                            newData.draft = (newData.draft || '') + data.content;
-                        } else if (data.agent === 'reviewer') {
-                            newData.critique = (newData.critique || '') + data.content;
-                        }
-                        
-                        return [...prev.slice(0, -1), { ...lastMsg, data: newData }];
-                    } else {
-                        // Start a new message for this stream
-                        const initialData: AgentData = {};
-                        if (data.agent === 'planner') initialData.novel_outline = data.content;
-                        else if (data.agent === 'writer') initialData.draft = data.content;
-                        else if (data.agent === 'reviewer') initialData.critique = data.content;
-                        
-                        return [...prev, { agent: data.agent, data: initialData, isFinal: false }];
-                    }
-                }
-                
-                // 2. Handle Final Node Output (End of Step)
-                else if (data.type === 'end') {
-                    // Update the last message with the final structured data
-                    if (lastMsg && lastMsg.agent === data.agent && !lastMsg.isFinal) {
-                        return [...prev.slice(0, -1), { agent: data.agent, data: data.data, isFinal: true }];
-                    } else {
-                        // Should rarely happen if stream came first, but handle it
-                        return [...prev, { agent: data.agent, data: data.data, isFinal: true }];
-                    }
-                }
-                
-                // 3. Handle Legacy/System Messages
-                else {
-                    // Handle error messages specifically
-                    if (data.error) {
-                        return [...prev, { agent: 'system', data: { message: `Error: ${data.error}` }, isFinal: true }];
-                    }
-                    // Handle generic system messages
-                    if (data.agent === 'system' || !data.agent) {
-                         return [...prev, { agent: 'system', data: data.data || { message: JSON.stringify(data) }, isFinal: true }];
-                    }
-                    return [...prev, { ...data, isFinal: true }];
-                }
-              });
-
-            } catch (e) {
-              console.error('Error parsing JSON', e);
-            }
+      await streamChat({
+        topic: currentTopic,
+        project_name: projectName,
+        granularity: mode === 'chapter' ? 'chapter' : 'novel',
+        chapter_title: mode === 'chapter' ? (chapterInfo?.title || '') : ''
+      }, (data) => {
+        setMessages((prev) => {
+          const lastMsg = prev[prev.length - 1];
+          
+          // 1. Handle Streaming Content
+          if (data.type === 'stream') {
+              // Check if we can append to the last message
+              if (lastMsg && lastMsg.agent === data.agent && !lastMsg.isFinal) {
+                  const newData = { ...lastMsg.data };
+                  
+                  // Append content to the correct field based on agent
+                  if (data.agent === 'planner') {
+                      newData.novel_outline = (newData.novel_outline || '') + data.content;
+                  } else if (data.agent === 'writer') {
+                      newData.draft = (newData.draft || '') + data.content;
+                  } else if (data.agent === 'reviewer') {
+                      newData.critique = (newData.critique || '') + data.content;
+                  }
+                  
+                  return [...prev.slice(0, -1), { ...lastMsg, data: newData }];
+              } else {
+                  // Start a new message for this stream
+                  const initialData: AgentData = {};
+                  if (data.agent === 'planner') initialData.novel_outline = data.content;
+                  else if (data.agent === 'writer') initialData.draft = data.content;
+                  else if (data.agent === 'reviewer') initialData.critique = data.content;
+                  
+                  return [...prev, { agent: data.agent, data: initialData, isFinal: false }];
+              }
           }
-        }
-      }
+          
+          // 2. Handle Final Node Output (End of Step)
+          else if (data.type === 'end') {
+              // Update the last message with the final structured data
+              if (lastMsg && lastMsg.agent === data.agent && !lastMsg.isFinal) {
+                  return [...prev.slice(0, -1), { agent: data.agent, data: data.data, isFinal: true }];
+              } else {
+                  // Should rarely happen if stream came first, but handle it
+                  return [...prev, { agent: data.agent, data: data.data, isFinal: true }];
+              }
+          }
+          
+          // 3. Handle Legacy/System Messages
+          else {
+              // Handle error messages specifically
+              if (data.error) {
+                  return [...prev, { agent: 'system', data: { message: `Error: ${data.error}` }, isFinal: true }];
+              }
+              // Handle generic system messages
+              if (data.agent === 'system' || !data.agent) {
+                   return [...prev, { agent: 'system', data: data.data || { message: JSON.stringify(data) }, isFinal: true }];
+              }
+              return [...prev, { ...data, isFinal: true }];
+          }
+        });
+      });
       
       // If in chapter mode, save the generated outline (delay to ensure messages are updated)
       if (mode === 'chapter' && chapterId) {
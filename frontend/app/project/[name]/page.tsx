@@ -128,20 +128,17 @@ export default function ProjectDashboard() {
         return;
       }
 
-      // 批量创建章节
-      for (const title of titles) {
-        if (title.trim()) {
-          try {
-            await fetch(`http://localhost:8000/api/projects/${projectName}/chapters`, {
-              method: 'POST',
-              headers: { 'Content-Type': 'application/json' },
-              body: JSON.stringify({ title: title.trim(), outline: '' })
-            });
-          } catch (error) {
-            console.error(`Failed to create chapter: ${title}`, error);
-          }
-        }
-      }
+      // 批量创建章节（一次请求）
+      const chapters = titles
+        .map((title: string) => title.trim())
+        .filter((title: string) => title)
+        .map((title: string) => ({ title, outline: '' }));
+      const batchRes = await fetch(`http://localhost:8000/api/projects/${projectName}/chapters/batch`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ chapters })
+      });
+      if (!batchRes.ok) console.error('Failed to create chapters', await batchRes.text());
 
       // 刷新章节列表
       fetchProjectData();
@@ -0,0 +1,75 @@
+const API_BASE = 'http://localhost:8000';
+const MAX_RECONNECTS = 3;
+const RECONNECT_DELAY_MS = 1000;
+
+/**
+ * POST to /api/chat and call onEvent for every parsed data event.
+ *
+ * Each event carries an "id: <stream_id>:<seq>" line. If the connection drops
+ * before [DONE], the stream is reopened via /api/streams/{id} with
+ * Last-Event-ID, so only the missed events are replayed.
+ */
+export async function streamChat(body: object, onEvent: (data: any) => void): Promise<void> {
+  let response = await fetch(`${API_BASE}/api/chat`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  });
+  if (!response.ok) throw new Error('Network response was not ok');
+
+  const streamId = response.headers.get('X-Stream-Id');
+  let lastEventId: string | null = null;
+  let reconnects = 0;
+
+  while (true) {
+    try {
+      const finished = await readEvents(response, onEvent, (id) => { lastEventId = id; });
+      if (finished) return;
+    } catch (e) {
+      if (!streamId || reconnects >= MAX_RECONNECTS) throw e;
+    }
+    // Stream ended without [DONE]: reconnect and resume after the last event we saw
+    if (!streamId || reconnects >= MAX_RECONNECTS) throw new Error('Stream interrupted');
+    reconnects += 1;
+    await new Promise((resolve) => setTimeout(resolve, RECONNECT_DELAY_MS));
+    response = await fetch(`${API_BASE}/api/streams/${streamId}${lastEventId ? '' : '?after=-1'}`, {
+      headers: lastEventId ? { 'Last-Event-ID': lastEventId } : {},
+    });
+    if (!response.ok) throw new Error(`Stream could not be resumed (${response.status})`);
+  }
+}
+
+/** Read SSE events until [DONE] (returns true) or the body ends early (returns false). */
+async function readEvents(response: Response, onEvent: (data: any) => void, onId: (id: string) => void): Promise<boolean> {
+  const reader = response.body?.getReader();
+  if (!reader) return false;
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) return false;
+
+    // Keep a trailing partial event in the buffer until the rest arrives
+    buffer += decoder.decode(value, { stream: true });
+    const blocks = buffer.split('\n\n');
+    buffer = blocks.pop() ?? '';
+
+    for (const block of blocks) {
+      let dataStr: string | null = null;
+      // Lines starting with ":" are heartbeat comments and are skipped
+      for (const line of block.split('\n')) {
+        if (line.startsWith('id: ')) onId(line.slice('id: '.length));
+        else if (line.startsWith('data: ')) dataStr = line.slice('data: '.length);
+      }
+      if (dataStr === null) continue;
+      if (dataStr === '[DONE]') return true;
+
+      try {
+        onEvent(JSON.parse(dataStr));
+      } catch (e) {
+        console.error('Error parsing JSON', e);
+      }
+    }
+  }
+}